@@ -1,13 +1,16 @@
 from django.contrib import admin
+from django.utils import timezone
 
 from cafe.models import ProductImage, Product, Category, CategoryImage, \
     Ingredient, Shipment, Warehouse, ProductIngredient, Basket, BasketItem, \
-    Order, DestructionIngredient
+    Order, DestructionIngredient, IngredientStock, DailySalesRollup, \
+    OrderLine, StockAlert, OrderTask
 
 
 class CategoryImageInline(admin.TabularInline):
     model = CategoryImage
-    fields = ('description', 'image', 'image_base64')
+    fields = ('description', 'image', 'thumbnail_jpeg', 'thumbnail_webp')
+    readonly_fields = ('thumbnail_jpeg', 'thumbnail_webp')
     extra = 0
     min_num = 0
     max_num = 1
@@ -20,7 +23,8 @@ class CategoryAdmin(admin.ModelAdmin):
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
-    fields = ('description', 'image', 'image_base64')
+    fields = ('description', 'image', 'thumbnail_jpeg', 'thumbnail_webp')
+    readonly_fields = ('thumbnail_jpeg', 'thumbnail_webp')
     extra = 0
     min_num = 0
     max_num = 1
@@ -28,7 +32,9 @@ class ProductImageInline(admin.TabularInline):
 
 class ProductAdmin(admin.ModelAdmin):
     inlines = (ProductImageInline, )
-    list_display = ('title', 'category', 'price', 'published')
+    list_display = ('title', 'category', 'price', 'cost', 'published')
+    # calculated from the flow chart by update_product_costs
+    readonly_fields = ('cost', )
     ordering = ('title',)
     search_fields = ('title',)
     list_filter = ('title', 'category', 'published', )
@@ -48,6 +54,23 @@ class ShipmentAdmin(admin.ModelAdmin):
     ordering = ('ingredient', )
     search_fields = ('ingredient', 'date', 'shelf_life', )
     list_filter = ('ingredient', 'date', 'shelf_life', )
+    actions = ('receive_again', )
+
+    def receive_again(self, request, queryset):
+        # the new lots keep the shelf life of the selected ones
+        now = timezone.now()
+        shipments = Shipment.objects.receive(
+            Shipment(
+                ingredient_id=shipment.ingredient_id,
+                value=shipment.value,
+                price=shipment.price,
+                shelf_life=now + (shipment.shelf_life - shipment.date)
+            )
+            for shipment in queryset
+        )
+        self.message_user(request, f'Принято поставок: {len(shipments)}')
+    receive_again.short_description = 'Повторить поставку'
+    receive_again.allowed_permissions = ('add', )
 
 
 class WarehouseAdmin(admin.ModelAdmin):
@@ -78,6 +101,21 @@ class WarehouseAdmin(admin.ModelAdmin):
     shipment_shelf_life.short_description = 'Срок годности'
 
 
+class IngredientStockAdmin(admin.ModelAdmin):
+    list_display = ('ingredient', 'on_hand', 'weighted_cost')
+    ordering = ('ingredient__title', )
+    search_fields = ('ingredient__title', )
+    readonly_fields = ('ingredient', 'on_hand', 'weighted_cost')
+
+
+class StockAlertAdmin(admin.ModelAdmin):
+    list_display = ('ingredient', 'on_hand', 'min_balance', 'created_at',
+                    'notified_at', 'resolved_at')
+    list_filter = ('resolved_at', )
+    readonly_fields = ('ingredient', 'on_hand', 'min_balance',
+                       'notified_at', 'resolved_at')
+
+
 class ProductIngredientAdmin(admin.ModelAdmin):
     list_display = ('product', 'ingredient', 'value', 'ingredient_measure_unit')
     ordering = ('product', )
@@ -91,20 +129,53 @@ class ProductIngredientAdmin(admin.ModelAdmin):
 
 
 class BasketAdmin(admin.ModelAdmin):
-    list_display = ('user', 'created_at')
+    list_display = ('user', 'created_at', 'status')
+    list_filter = ('status', )
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    fields = ('product', 'count', 'unit_price', 'unit_cost')
+    readonly_fields = ('product', 'count', 'unit_price', 'unit_cost')
+    extra = 0
+    can_delete = False
 
 
 class OrderAdmin(admin.ModelAdmin):
+    inlines = (OrderLineInline, )
     list_display = ('id', 'basket', 'created_at', 'price', 'cost')
 
 
+class OrderTaskAdmin(admin.ModelAdmin):
+    list_display = ('order', 'created_at', 'run_after', 'attempts')
+    list_filter = ('attempts', )
+    readonly_fields = ('order', 'attempts', 'last_error')
+    actions = ('retry', )
+
+    def retry(self, request, queryset):
+        count = queryset.update(attempts=0, run_after=timezone.now())
+        self.message_user(request, f'Задач в очереди: {count}')
+    retry.short_description = 'Повторить'
+    retry.allowed_permissions = ('change', )
+
+
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'revenue', 'cost', 'order_count')
+    ordering = ('-date', )
+    readonly_fields = ('date', 'revenue', 'cost', 'order_count')
+
+
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Shipment, ShipmentAdmin)
 admin.site.register(Warehouse, WarehouseAdmin)
+admin.site.register(IngredientStock, IngredientStockAdmin)
+admin.site.register(StockAlert, StockAlertAdmin)
 admin.site.register(ProductIngredient, ProductIngredientAdmin)
 admin.site.register(Basket, BasketAdmin)
 admin.site.register(BasketItem)
 admin.site.register(Order, OrderAdmin)
+admin.site.register(OrderTask, OrderTaskAdmin)
+admin.site.register(DailySalesRollup, DailySalesRollupAdmin)
 admin.site.register(DestructionIngredient)
@@ -0,0 +1,63 @@
+"""Low stock alert delivery backends.
+
+A backend is a class with a ``send(alerts)`` method that gets a list of
+StockAlert objects, backends are listed in CAFE_STOCK_ALERT_BACKENDS.
+"""
+import json
+import logging
+import urllib.request
+
+from django.conf import settings
+from django.core.mail import send_mail
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_TIMEOUT = 5
+
+
+def format_alert(alert):
+    return (f'{alert.ingredient}: остаток {alert.on_hand:.2f}, '
+            f'минимум {alert.min_balance:.2f}')
+
+
+class LogBackend:
+    def send(self, alerts):
+        for alert in alerts:
+            logger.warning('Low stock of %s', format_alert(alert))
+
+
+class EmailBackend:
+    """Sends the alerts with EMAIL_BACKEND, the console one by default."""
+
+    def send(self, alerts):
+        if not settings.CAFE_STOCK_ALERT_EMAILS:
+            return
+        send_mail(
+            f'Заканчиваются ингредиенты: {len(alerts)}',
+            '\n'.join(format_alert(alert) for alert in alerts),
+            None,
+            settings.CAFE_STOCK_ALERT_EMAILS
+        )
+
+
+class WebhookBackend:
+    def send(self, alerts):
+        if not settings.CAFE_STOCK_ALERT_WEBHOOK_URL:
+            return
+        data = json.dumps({'alerts': [
+            {
+                'ingredient_id': alert.ingredient_id,
+                'ingredient': str(alert.ingredient),
+                'on_hand': alert.on_hand,
+                'min_balance': alert.min_balance,
+                'created_at': alert.created_at.isoformat(),
+            }
+            for alert in alerts
+        ]}).encode()
+        request = urllib.request.Request(
+            settings.CAFE_STOCK_ALERT_WEBHOOK_URL,
+            data=data,
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT):
+            pass
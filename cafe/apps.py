@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class CafeConfig(AppConfig):
     name = 'cafe'
+
+    def ready(self):
+        import cafe.signals  # noqa
+        from coffee_point.db import check_connections
+        # runs after close_old_connections dropped the expired ones
+        request_started.connect(check_connections)
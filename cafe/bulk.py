@@ -0,0 +1,34 @@
+from itertools import islice
+
+BATCH_SIZE = 2000
+
+
+def chunked(objs, size=BATCH_SIZE):
+    objs = iter(objs)
+    while chunk := list(islice(objs, size)):
+        yield chunk
+
+
+def bulk_create(model, objs):
+    # the backend splits the chunks further if it limits query parameters
+    for chunk in chunked(objs):
+        model.objects.bulk_create(chunk)
+
+
+def create_with_ids(model, objs):
+    """Bulk creates ``objs`` and makes sure they have primary keys.
+
+    Backends that can not return the ids from a bulk insert get them
+    from the newest rows, so it must run in a transaction that keeps
+    other writers out of the table (SQLite locks the whole database).
+    """
+    created = []
+    for chunk in chunked(objs):
+        model.objects.bulk_create(chunk)
+        if chunk[0].pk is None:
+            ids = model.objects.order_by('-pk').values_list(
+                'pk', flat=True)[:len(chunk)]
+            for obj, pk in zip(chunk, reversed(list(ids))):
+                obj.pk = pk
+        created += chunk
+    return created
@@ -0,0 +1,190 @@
+import csv
+import zipfile
+from itertools import groupby
+from xml.sax.saxutils import escape
+
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from cafe.models import OrderLine
+from cafe.services import get_daily_sales, get_orders_in_range, \
+    get_datetime_range
+
+CHUNK_SIZE = 2000
+
+DAY_HEADER = (
+    'Дата', 'Продукт', 'Количество', 'Выручка', 'Закупка', 'Кол-во чеков')
+ORDER_HEADER = (
+    'Заказ', 'Дата', 'Продукт', 'Количество', 'Цена', 'Выручка', 'Закупка')
+
+
+def get_day_rows(from_date, to_date):
+    start, end = get_datetime_range(from_date, to_date)
+    products = OrderLine.objects.filter(
+        created_at__gte=start,
+        created_at__lt=end
+    ).annotate(
+        date=TruncDate('created_at')
+    ).values(
+        'date', 'product__title'
+    ).annotate(
+        quantity=Sum('count'),
+        revenue=Sum(F('count') * F('unit_price'), output_field=FloatField()),
+        cost=Sum(F('count') * F('unit_cost'), output_field=FloatField())
+    ).order_by('date', 'product__title').iterator(chunk_size=CHUNK_SIZE)
+    products_by_date = groupby(products, key=lambda row: row['date'])
+    date, day_products = next(products_by_date, (None, ()))
+
+    yield DAY_HEADER
+    for day in get_daily_sales(from_date, to_date):
+        yield (day['date'], 'Итого', None, day['revenue'], day['cost'],
+               day['order_count'])
+        while date is not None and date <= day['date']:
+            if date == day['date']:
+                for product in day_products:
+                    yield (date, product['product__title'],
+                           product['quantity'], round(product['revenue'], 2),
+                           round(product['cost'], 2), None)
+            date, day_products = next(products_by_date, (None, ()))
+
+
+def get_order_rows(from_date, to_date):
+    lines = get_orders_in_range(from_date, to_date).values(
+        'id',
+        'created_at',
+        'price',
+        'cost',
+        'lines__product__title',
+        'lines__count',
+        'lines__unit_price',
+        'lines__unit_cost'
+    ).order_by('id', 'lines__id').iterator(chunk_size=CHUNK_SIZE)
+
+    yield ORDER_HEADER
+    for order_id, order_lines in groupby(lines, key=lambda row: row['id']):
+        line = next(order_lines)
+        created_at = timezone.localtime(line['created_at']).strftime(
+            '%Y-%m-%d %H:%M:%S')
+        yield (order_id, created_at, 'Итого', None, None, line['price'],
+               line['cost'])
+        for line in (line, *order_lines):
+            if line['lines__count'] is None:
+                continue
+            count = line['lines__count']
+            yield (order_id, created_at, line['lines__product__title'], count,
+                   line['lines__unit_price'],
+                   round(line['lines__unit_price'] * count, 2),
+                   round(line['lines__unit_cost'] * count, 2))
+
+
+class StreamBuffer:
+    """File-like object that keeps written data until it is drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo(), delimiter=';')
+    # the BOM lets Excel detect the encoding
+    yield '\ufeff'.encode()
+    for row in rows:
+        yield writer.writerow(row).encode()
+
+
+XLSX_CONTENT_TYPE = \
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'content-types">'
+        '<Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+        'worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+        '2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships">'
+        '<sheets><sheet name="Отчёт" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def stream_xlsx(rows, rows_per_chunk=500):
+    # the archive is written to a buffer that is drained after every chunk
+    # of rows, zip entries use data descriptors since the output is not
+    # seekable
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        yield buffer.drain()
+        with archive.open(
+                'xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/'
+                b'spreadsheetml/2006/main"><sheetData>'
+            )
+            for index, row in enumerate(rows, start=1):
+                sheet.write(
+                    f'<row>{"".join(map(xlsx_cell, row))}</row>'.encode())
+                if index % rows_per_chunk == 0:
+                    yield buffer.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
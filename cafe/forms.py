@@ -1,12 +1,21 @@
+import csv
+import io
+from datetime import datetime, time
+
 from django import forms
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from cafe.models import Product, Basket
+from cafe.models import Product, Basket, BasketItem, Ingredient, Shipment
 
 
 class BasketEditForm(forms.Form):
     product_id = forms.IntegerField(required=True)
-    product_count = forms.IntegerField(required=True)
+    product_count = forms.IntegerField(
+        required=True,
+        min_value=-BasketItem.MAX_COUNT,
+        max_value=BasketItem.MAX_COUNT
+    )
 
     def clean_product_id(self):
         product_id = self.cleaned_data['product_id']
@@ -23,6 +32,8 @@ class BasketEditForm(forms.Form):
 
 class OrderForm(forms.Form):
     basket_id = forms.IntegerField(required=True)
+    # sent by the terminal to sync the order again if it gets no answer
+    client_key = forms.UUIDField(required=False)
 
     def clean_basket_id(self):
         basket_id = self.cleaned_data['basket_id']
@@ -52,3 +63,120 @@ class ReportEditForm(forms.Form):
             )
         self._clean_date(to_date)
         return to_date
+
+
+class AnalyticsForm(ReportEditForm):
+    group_by = forms.ChoiceField(
+        choices=(
+            ('product', 'Продукт'),
+            ('category', 'Категория'),
+            ('hour', 'Час'),
+        ),
+        initial='product'
+    )
+
+
+# cleans the cells of an invoice row, accepting the local number format
+INVOICE_NUMBER = forms.FloatField(min_value=0, localize=True)
+INVOICE_DATE = forms.DateField(localize=True)
+
+
+class ShipmentImportForm(forms.Form):
+    """Supplier invoice in CSV with a header row.
+
+    The columns are ``ingredient`` (title), ``value``, ``price`` and
+    ``shelf_life`` (date), separated by commas or semicolons.
+    """
+    COLUMNS = ('ingredient', 'value', 'price', 'shelf_life')
+
+    invoice = forms.FileField(label='Накладная (CSV)')
+
+    def clean_invoice(self):
+        try:
+            text = self.cleaned_data['invoice'].read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise forms.ValidationError('Файл должен быть в кодировке UTF-8')
+        delimiter = ';' if ';' in text.partition('\n')[0] else ','
+        reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
+        missing = set(self.COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            raise forms.ValidationError(
+                f'Нет столбцов: {", ".join(sorted(missing))}')
+        rows = list(reader)
+        if not rows:
+            raise forms.ValidationError('В накладной нет строк')
+
+        ingredients = Ingredient.objects.in_bulk(
+            {(row['ingredient'] or '').strip() for row in rows},
+            field_name='title'
+        )
+        shipments = []
+        errors = []
+        # the header is the first line of the file
+        for line, row in enumerate(rows, start=2):
+            try:
+                shipments.append(self._make_shipment(row, ingredients))
+            except forms.ValidationError as error:
+                errors += [f'Строка {line}: {message}'
+                           for message in error.messages]
+        if errors:
+            raise forms.ValidationError(errors)
+        self.cleaned_data['shipments'] = shipments
+        return self.cleaned_data['invoice']
+
+    def _make_shipment(self, row, ingredients):
+        title = (row['ingredient'] or '').strip()
+        if title not in ingredients:
+            raise forms.ValidationError(f'Неизвестный ингредиент "{title}"')
+        shelf_life = INVOICE_DATE.clean(row['shelf_life'])
+        return Shipment(
+            ingredient=ingredients[title],
+            value=INVOICE_NUMBER.clean(row['value']),
+            price=INVOICE_NUMBER.clean(row['price']),
+            # the lot is good until the end of the day
+            shelf_life=timezone.make_aware(
+                datetime.combine(shelf_life, time.max))
+        )
+
+
+class OfflineItemsField(forms.Field):
+    """List of {product_id, count} objects, cleaned to product -> count."""
+
+    def to_python(self, value):
+        if not value:
+            return {}
+        if not isinstance(value, list):
+            raise forms.ValidationError('Invalid items')
+        items = {}
+        for item in value:
+            try:
+                product_id = int(item['product_id'])
+                count = int(item['count'])
+            except (KeyError, TypeError, ValueError):
+                raise forms.ValidationError('Invalid items')
+            items[product_id] = items.get(product_id, 0) + count
+            if count <= 0 or items[product_id] > BasketItem.MAX_COUNT:
+                raise forms.ValidationError('Invalid product count')
+        return items
+
+
+class OfflineOrderForm(forms.Form):
+    """Order queued by a terminal, the data is a decoded JSON object."""
+    key = forms.UUIDField(required=True)
+    basket_id = forms.IntegerField(required=False)
+    created_at = forms.CharField(required=False)
+    items = OfflineItemsField(required=True)
+
+    def clean_created_at(self):
+        value = self.cleaned_data['created_at']
+        if not value:
+            return None
+        try:
+            created_at = parse_datetime(value)
+        except ValueError:
+            created_at = None
+        if created_at is None:
+            raise forms.ValidationError('Invalid date')
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        return created_at
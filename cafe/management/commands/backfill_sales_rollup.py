@@ -0,0 +1,42 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from cafe.models import DailySalesRollup, Order
+
+
+class Command(BaseCommand):
+    help = 'Recalculates daily sales rollups from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from-date',
+            type=datetime.fromisoformat,
+            help='First day to recalculate, YYYY-MM-DD'
+        )
+        parser.add_argument(
+            '--to-date',
+            type=datetime.fromisoformat,
+            help='Last day to recalculate, YYYY-MM-DD'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        rollups = DailySalesRollup.objects.all()
+        if options['from_date']:
+            from_date = options['from_date'].date()
+            orders = orders.filter(created_at__gte=timezone.make_aware(
+                datetime.combine(from_date, time.min)))
+            rollups = rollups.filter(date__gte=from_date)
+        if options['to_date']:
+            to_date = options['to_date'].date()
+            orders = orders.filter(created_at__lt=timezone.make_aware(
+                datetime.combine(to_date + timedelta(days=1), time.min)))
+            rollups = rollups.filter(date__lte=to_date)
+        # days without orders left in the range are stale
+        rollups.delete()
+        days = DailySalesRollup.objects.rebuild(orders)
+        self.stdout.write(f'Rebuilt sales rollups for {len(days)} days')
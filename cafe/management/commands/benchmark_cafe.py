@@ -0,0 +1,140 @@
+import math
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from cafe.models import BasketItem
+from cafe.seed import seed_catalog, seed_orders, seed_stock
+from cafe.services import checkout, open_basket
+
+PREFIX = 'benchmark_cafe'
+
+
+class Rollback(Exception):
+    pass
+
+
+def run_commit_hooks():
+    # nothing is committed, so the work a commit would start (product
+    # costs, stock alerts, menu invalidation) is run here to be measured
+    while connection.run_on_commit:
+        hooks = connection.run_on_commit
+        connection.run_on_commit = []
+        for _, hook in hooks:
+            hook()
+
+
+def percentile(values, percent):
+    # nearest-rank percentile
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Measures the barista hot paths on a seeded dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=300)
+        parser.add_argument('--ingredients', type=int, default=60)
+        parser.add_argument('--lots', type=int, default=3000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--orders-per-day', type=int, default=100)
+        parser.add_argument('--items', type=int, default=10,
+                            help='Products in a checked out basket')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # the dataset is created in a transaction that is rolled back
+        try:
+            with transaction.atomic():
+                self.run_benchmarks(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run_benchmarks(self, options):
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        user = User.objects.create(username=PREFIX, is_staff=True)
+        products, ingredients = seed_catalog(
+            rng, PREFIX, categories=10, products=options['products'],
+            ingredients=options['ingredients'], ingredients_per_product=4)
+        seed_stock(rng, ingredients, options['lots'])
+        seed_orders(
+            rng, [user], products, options['days'], options['orders_per_day'])
+        self.stdout.write(
+            f'Seeded in {time.perf_counter() - start:.1f} s')
+
+        client = Client()
+        client.force_login(user)
+        today = timezone.localdate()
+        product_ids = [product.id for product in products]
+
+        def report(days):
+            from_date = today - timedelta(days=days - 1)
+            return lambda: client.get(reverse('report'), {
+                'from_date': from_date, 'to_date': today})
+
+        def basket_edit():
+            client.post(reverse('api-basket-items'), {
+                'product_id': rng.choice(product_ids), 'product_count': 1})
+
+        # the checked out baskets belong to another barista, the basket
+        # edit scenario keeps filling the active basket of the user
+        cashier = User.objects.create(username=f'{PREFIX}_cashier')
+
+        def make_basket():
+            basket = open_basket(cashier.id)
+            BasketItem.objects.bulk_create(
+                BasketItem(basket=basket, product=product, count=1)
+                for product in rng.sample(products, options['items']))
+            return basket
+
+        scenarios = (
+            ('home', lambda: client.get(reverse('home')), None),
+            ('basket edit', basket_edit, None),
+            (f'checkout {options["items"]} items', checkout, make_basket),
+            ('queued checkout',
+             lambda basket: checkout(basket, in_background=True),
+             make_basket),
+            ('report 30 days', report(30), None),
+            ('report 365 days', report(365), None),
+            ('warehouse', lambda: client.get(reverse('warehouse')), None),
+            ('warehouse lots', lambda: client.get(reverse('warehouse'), {
+                'ingredient': rng.choice(ingredients).id}), None),
+        )
+        self.stdout.write(
+            f'{"scenario":<24}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+            f'{"max ms":>9}{"queries":>9}')
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, func, setup in scenarios:
+                self.measure(name, func, setup, options['repeat'])
+
+    def measure(self, name, func, setup, repeat):
+        timings = []
+        queries = []
+        for _ in range(repeat):
+            args = (setup(), ) if setup else ()
+            # the hooks of the seeding and the setup are not measured
+            run_commit_hooks()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                func(*args)
+                run_commit_hooks()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context.captured_queries))
+        self.stdout.write(
+            f'{name:<24}{percentile(timings, 50):>9.2f}'
+            f'{percentile(timings, 95):>9.2f}{percentile(timings, 99):>9.2f}'
+            f'{max(timings):>9.2f}{statistics.mean(queries):>9.1f}'
+        )
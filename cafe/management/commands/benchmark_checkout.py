@@ -0,0 +1,136 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cafe.management.commands.benchmark_cafe import run_commit_hooks
+from cafe.models import Basket, BasketItem, Category, Ingredient, Order, \
+    Product, ProductIngredient, Shipment
+from cafe.services import checkout, open_basket
+
+
+def legacy_checkout(basket):
+    # the per-item loop OrderView used before the set-based checkout,
+    # kept as a reference for benchmarks and tests
+    basket_items = basket.items.all()
+    if basket_items:
+        Basket.objects.filter(id=basket.id).update(
+            status=Basket.Status.ORDERED)
+        Basket.objects.get_or_create(
+            user=basket.user, status=Basket.Status.ACTIVE)
+    order_sum = 0
+    order_cost = 0
+    for item in basket_items:
+        order_sum += round(item.count * item.product.price, 2)
+        flow_charts = Product.objects.filter(
+            id=item.product.id
+        ).prefetch_related('flow_chart').first()
+        for flow_chart in flow_charts.flow_chart.all():
+            shipment_of_cost = Shipment.objects.filter(
+                ingredient=flow_chart.ingredient,
+                warehouses__isnull=False).first()
+            if shipment_of_cost:
+                value_ingredient = flow_chart.value * item.count
+                warehouse = shipment_of_cost.warehouses.first()
+                if warehouse.value > value_ingredient:
+                    warehouse.value -= value_ingredient
+                    warehouse.save()
+                else:
+                    warehouse.delete()
+            else:
+                shipment_of_cost = Shipment.objects.filter(
+                    ingredient=flow_chart.ingredient
+                ).order_by('-date').first()
+            if shipment_of_cost:
+                cost_ingredient = shipment_of_cost.price
+            else:
+                cost_ingredient = 0
+            order_cost += round(
+                cost_ingredient * item.count * flow_chart.value, 2)
+    return Order.objects.create(
+        basket=basket,
+        price=order_sum,
+        cost=order_cost
+    )
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compares the set-based checkout with the legacy per-item loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=6)
+        parser.add_argument('--ingredients', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username='benchmark_checkout')
+                products = self.seed(options['items'], options['ingredients'])
+                for name, func in (('legacy', legacy_checkout),
+                                   ('checkout', checkout)):
+                    self.run(name, func, user, products, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, items, ingredients):
+        category = Category.objects.create(
+            title='benchmark_checkout', slug='benchmark_checkout')
+        shelf_life = timezone.now() + timedelta(days=30)
+        ingredient_objs = []
+        for i in range(ingredients):
+            ingredient = Ingredient.objects.create(
+                title=f'benchmark_checkout {i}')
+            for _ in range(3):
+                Shipment.objects.create(
+                    ingredient=ingredient,
+                    value=10 ** 6,
+                    price=1.5,
+                    shelf_life=shelf_life
+                )
+            ingredient_objs.append(ingredient)
+        products = []
+        for i in range(items):
+            product = Product.objects.create(
+                title=f'benchmark_checkout {i}',
+                price=3.5,
+                published=True,
+                category=category
+            )
+            ProductIngredient.objects.bulk_create(
+                ProductIngredient(
+                    product=product, ingredient=ingredient, value=0.1)
+                for ingredient in ingredient_objs
+            )
+            products.append(product)
+        return products
+
+    def run(self, name, func, user, products, repeat):
+        elapsed = 0
+        queries = 0
+        for _ in range(repeat):
+            basket = open_basket(user.id)
+            BasketItem.objects.bulk_create(
+                BasketItem(basket=basket, product=product, count=2)
+                for product in products
+            )
+            run_commit_hooks()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                func(basket)
+                run_commit_hooks()
+                elapsed += time.perf_counter() - start
+            queries += len(context.captured_queries)
+        self.stdout.write(
+            f'{name}: {elapsed / repeat * 1000:.2f} ms, '
+            f'{queries / repeat:.0f} queries per checkout'
+        )
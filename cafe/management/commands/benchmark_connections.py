@@ -0,0 +1,115 @@
+import sys
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from cafe.management.commands.benchmark_cafe import percentile
+
+PAGES = ('home', 'api-basket', 'warehouse', 'report')
+
+
+def set_conn_max_age(max_age):
+    for conn in connections.all():
+        conn.close()
+        conn.settings_dict['CONN_MAX_AGE'] = max_age
+
+
+class Command(BaseCommand):
+    help = ('Measures the barista pages with a connection per request and '
+            'with persistent connections')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=60,
+            help='CONN_MAX_AGE compared with 0'
+        )
+        parser.add_argument(
+            '--user',
+            help='Username the pages are opened by, the first staff user '
+                 'by default'
+        )
+
+    def handle(self, *args, **options):
+        # the requests go through the WSGI handler like in gunicorn, the
+        # test client would keep the connection open between them
+        users = User.objects.filter(is_staff=True).order_by('id')
+        if options['user']:
+            users = User.objects.filter(username=options['user'])
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to open the pages, run seed_cafe')
+        client = Client()
+        client.force_login(user)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={session}'
+        self.handler = WSGIHandler()
+        self.opened = 0
+        connection_created.connect(self.count_connection)
+        max_age = connections['default'].settings_dict['CONN_MAX_AGE']
+
+        self.stdout.write(
+            f'{"page":<14}{"max age":>9}{"p50 ms":>9}{"p95 ms":>9}'
+            f'{"conn/req":>10}')
+        try:
+            for page in PAGES:
+                self.request(reverse(page))
+            for conn_max_age in (0, options['max_age']):
+                set_conn_max_age(conn_max_age)
+                for page in PAGES:
+                    self.measure(page, conn_max_age, options['repeat'])
+        finally:
+            connection_created.disconnect(self.count_connection)
+            set_conn_max_age(max_age)
+            client.logout()
+
+    def count_connection(self, **kwargs):
+        self.opened += 1
+
+    def request(self, path):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_COOKIE': self.cookie,
+            'wsgi.input': BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+        }
+        statuses = []
+        response = self.handler(
+            environ, lambda status, headers: statuses.append(status))
+        try:
+            b''.join(response)
+        finally:
+            # closing the response ends the request like in gunicorn
+            response.close()
+        if not statuses[0].startswith('200'):
+            raise CommandError(f'{path} answered {statuses[0]}')
+
+    def measure(self, page, conn_max_age, repeat):
+        path = reverse(page)
+        timings = []
+        opened = self.opened
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.request(path)
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f'{page:<14}{conn_max_age:>9}{percentile(timings, 50):>9.2f}'
+            f'{percentile(timings, 95):>9.2f}'
+            f'{(self.opened - opened) / repeat:>10.2f}'
+        )
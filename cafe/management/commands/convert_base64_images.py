@@ -0,0 +1,49 @@
+import base64
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from cafe.models import CategoryImage, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Builds the thumbnails of the images that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        for model in (CategoryImage, ProductImage):
+            converted, missing = self.convert(model, options['batch_size'])
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: converted {converted}, '
+                f'without a source {missing}')
+
+    def convert(self, model, batch_size):
+        images = model.objects.filter(thumbnail_jpeg='')
+        converted = 0
+        missing = 0
+        last_id = 0
+        # blobs are loaded one batch at a time to keep memory flat
+        while batch := list(images.filter(id__gt=last_id).order_by('id')[
+                :batch_size]):
+            last_id = batch[-1].id
+            for image in batch:
+                if self.convert_image(image):
+                    converted += 1
+                else:
+                    missing += 1
+        return converted, missing
+
+    def convert_image(self, image):
+        # the inline copy stays, it is the only one that outlives the dyno
+        if image.image_base64:
+            image.set_thumbnails(BytesIO(base64.b64decode(
+                image.image_base64.partition('base64,')[2])))
+        elif image.image and image.image.storage.exists(image.image.name):
+            image.image.open()
+            image.set_thumbnails(image.image)
+        else:
+            return False
+        image.save(update_fields=['thumbnail_jpeg', 'thumbnail_webp'])
+        return True
@@ -0,0 +1,84 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from cafe.models import Basket, Category, Ingredient, Warehouse
+from cafe.services import get_orders_in_range, get_products_pr_images, \
+    get_sales_analytics, get_stock_lots
+from error_log.models import RequestError
+
+# "Seq Scan on cafe_order" on PostgreSQL, "SCAN cafe_order" or
+# "SCAN TABLE cafe_order" without an index on SQLite
+SEQ_SCAN = re.compile(r'Seq Scan on (\w+)|\bSCAN (?:TABLE )?(\w+)$')
+
+
+def get_hot_queries():
+    """Returns the queries of the hot paths with parameters from the data.
+
+    Missing rows are replaced with ids that match nothing, an empty IN
+    list would not reach the database at all.
+    """
+    today = timezone.localdate()
+    user_id = Basket.objects.values_list('user_id', flat=True).last() or 0
+    ingredient_ids = list(
+        Ingredient.objects.values_list('id', flat=True)[:5]) or [0]
+    category = Category.objects.first()
+    return {
+        'report orders': get_orders_in_range(
+            today - timedelta(days=30), today),
+        'report lines': get_sales_analytics(
+            today - timedelta(days=30), today, 'product'),
+        'active basket': Basket.objects.filter(
+            user_id=user_id, status=Basket.Status.ACTIVE),
+        'stock lots': get_stock_lots(ingredient_ids),
+        'expired lots': Warehouse.objects.filter(
+            value__gt=0, shipment__shelf_life__lte=timezone.now()
+        ).order_by('shipment__shelf_life', 'id'),
+        'menu': get_products_pr_images(),
+        'category menu': get_products_pr_images().filter(
+            category__slug=category.slug if category else ''),
+        'request errors': RequestError.objects.all()[:100],
+    }
+
+
+def find_seq_scans(plan):
+    tables = []
+    for line in plan.splitlines():
+        match = SEQ_SCAN.search(line.strip())
+        if match:
+            tables.append(match.group(1) or match.group(2))
+    return tables
+
+
+class Command(BaseCommand):
+    help = 'Prints the plans of the hot queries and flags sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fail',
+            action='store_true',
+            help='Exit with an error if a query scans a whole table'
+        )
+
+    def handle(self, *args, **options):
+        # ANALYZE runs the query, SQLite can only print the plan
+        explain_options = {}
+        if connection.vendor == 'postgresql':
+            explain_options = {'analyze': True, 'buffers': True}
+        flagged = []
+        for name, queryset in get_hot_queries().items():
+            plan = queryset.explain(**explain_options)
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            for table in find_seq_scans(plan):
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(
+                    f'Sequential scan on {table}'))
+        # small tables are scanned whatever the indexes are, run it on
+        # production sized data
+        if flagged and options['fail']:
+            raise CommandError(
+                f'Sequential scans in: {", ".join(sorted(set(flagged)))}')
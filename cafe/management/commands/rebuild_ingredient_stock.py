@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cafe.models import IngredientStock
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds ingredient balances from the warehouse lots'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report balances that differ from the lots'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        expected = IngredientStock.objects.calculate()
+        actual = IngredientStock.objects.select_for_update().in_bulk()
+        mismatched = []
+        for ingredient_id, stock in expected.items():
+            current = actual.get(
+                ingredient_id, IngredientStock(ingredient_id=ingredient_id))
+            if abs(current.on_hand - stock.on_hand) > stock.EPSILON or \
+                    abs(current.weighted_cost - stock.weighted_cost) > 0.005:
+                mismatched.append((current, stock))
+
+        for current, stock in mismatched:
+            self.stdout.write(
+                f'{stock.ingredient}: '
+                f'on hand {current.on_hand} -> {stock.on_hand}, '
+                f'weighted cost {current.weighted_cost} -> '
+                f'{stock.weighted_cost}'
+            )
+        if options['verify']:
+            if mismatched:
+                raise CommandError(
+                    f'{len(mismatched)} ingredient balances are out of sync')
+            self.stdout.write('Ingredient balances are in sync')
+            return
+
+        IngredientStock.objects.bulk_create(
+            stock for stock in expected.values()
+            if stock.ingredient_id not in actual
+        )
+        IngredientStock.objects.bulk_update(
+            [stock for stock in expected.values()
+             if stock.ingredient_id in actual],
+            ['on_hand', 'weighted_cost']
+        )
+        self.stdout.write(f'Rebuilt {len(expected)} ingredient balances')
@@ -0,0 +1,55 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cafe.services import process_order_tasks
+from coffee_point.db import check_connections
+
+
+class Command(BaseCommand):
+    help = 'Takes the stock of checked out orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Orders processed in one transaction'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when there are no orders'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the queued orders and exit'
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        if not options['once']:
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        total = 0
+        while not self.stopping:
+            count = process_order_tasks(options['batch_size'])
+            total += count
+            if options['once'] and not count:
+                break
+            if not count:
+                time.sleep(options['interval'])
+            # the worker runs for days, broken and expired connections are
+            # dropped as at the end of a request
+            if not options['once']:
+                close_old_connections()
+                check_connections()
+        self.stdout.write(f'Processed {total} orders')
+
+    def stop(self, signum, frame):
+        # the current batch is finished before the worker exits
+        self.stopping = True
@@ -0,0 +1,107 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cafe.bulk import create_with_ids
+from cafe.models import Category
+from cafe.seed import seed_catalog, seed_orders, seed_stock
+
+PRESETS = {
+    'small': {
+        'categories': 5,
+        'products': 50,
+        'ingredients': 30,
+        'ingredients_per_product': 3,
+        'lots': 500,
+        'baristas': 2,
+        'days': 90,
+        'orders_per_day': 50,
+    },
+    'medium': {
+        'categories': 20,
+        'products': 500,
+        'ingredients': 200,
+        'ingredients_per_product': 4,
+        'lots': 20000,
+        'baristas': 5,
+        'days': 365,
+        'orders_per_day': 500,
+    },
+    'large': {
+        'categories': 50,
+        'products': 2000,
+        'ingredients': 500,
+        'ingredients_per_product': 5,
+        'lots': 200000,
+        'baristas': 20,
+        'days': 730,
+        'orders_per_day': 2000,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Generates a catalog, stock and order history for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--preset',
+            choices=PRESETS,
+            default='small',
+            help='Dataset size, the options below override its values'
+        )
+        for name in PRESETS['small']:
+            parser.add_argument(
+                f'--{name.replace("_", "-")}', type=int, dest=name)
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed, the same seed generates the same data'
+        )
+        parser.add_argument(
+            '--prefix',
+            default='seed',
+            help='Prefix of the generated titles and usernames'
+        )
+
+    def handle(self, *args, **options):
+        sizes = {
+            name: value if options[name] is None else options[name]
+            for name, value in PRESETS[options['preset']].items()
+        }
+        prefix = options['prefix']
+        if Category.objects.filter(slug=f'{prefix}-0').exists():
+            raise CommandError(
+                f'Data with the prefix "{prefix}" exists, use --prefix')
+
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        with transaction.atomic():
+            users = create_with_ids(User, (
+                User(username=f'{prefix}_barista_{i}',
+                     password=make_password(None))
+                for i in range(sizes['baristas'])
+            ))
+            products, ingredients = seed_catalog(
+                rng, prefix, sizes['categories'], sizes['products'],
+                sizes['ingredients'], sizes['ingredients_per_product'])
+            seed_stock(rng, ingredients, sizes['lots'])
+            self.stdout.write(
+                f'Catalog and {sizes["lots"]} lots in '
+                f'{time.perf_counter() - start:.1f} s')
+            seed_orders(
+                rng, users, products, sizes['days'],
+                sizes['orders_per_day'], progress=self.progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {sizes["days"] * sizes["orders_per_day"]} orders in '
+            f'{time.perf_counter() - start:.1f} s'
+        ))
+
+    def progress(self, date):
+        if date.day == 1:
+            self.stdout.write(f'Seeded orders up to {date}')
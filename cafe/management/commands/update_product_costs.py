@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cafe.services import update_product_costs
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the cost of every product from the stock'
+
+    def handle(self, *args, **options):
+        count = update_product_costs()
+        self.stdout.write(f'Updated the cost of {count} products')
@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from cafe.models import DestructionIngredient
+
+
+class Command(BaseCommand):
+    help = 'Writes off warehouse lots past their shelf life, run it hourly'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Lots written off in one transaction'
+        )
+        parser.add_argument(
+            '--user',
+            help='Username recorded in the write-offs, none by default'
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User "{options["user"]}" does not exist')
+        count = DestructionIngredient.objects.write_off_expired(
+            options['batch_size'], user=user)
+        self.stdout.write(f'Wrote off {count} expired lots')
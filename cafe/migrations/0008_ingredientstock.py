@@ -0,0 +1,55 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:29
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+import django.db.models.deletion
+
+
+def fill_ingredient_stock(apps, schema_editor):
+    Warehouse = apps.get_model('cafe', 'Warehouse')
+    IngredientStock = apps.get_model('cafe', 'IngredientStock')
+    lots = Warehouse.objects.filter(value__gt=0).values(
+        'shipment__ingredient_id'
+    ).annotate(
+        on_hand=Sum('value'),
+        stock_value=Sum(
+            F('value') * F('shipment__price'),
+            output_field=models.FloatField()
+        )
+    ).order_by()
+    IngredientStock.objects.bulk_create(
+        IngredientStock(
+            ingredient_id=lot['shipment__ingredient_id'],
+            on_hand=lot['on_hand'],
+            weighted_cost=lot['stock_value'] / lot['on_hand']
+        )
+        for lot in lots
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0007_auto_20200526_1105'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientStock',
+            fields=[
+                ('ingredient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock', serialize=False, to='cafe.Ingredient', verbose_name='Ингридиент')),
+                ('on_hand', models.FloatField(default=0, verbose_name='Остаток')),
+                ('weighted_cost', models.FloatField(default=0, verbose_name='Средневзвешенная цена')),
+            ],
+            options={
+                'verbose_name': 'Остаток ингридиента',
+                'verbose_name_plural': 'Остатки ингридиентов',
+            },
+        ),
+        migrations.AddField(
+            model_name='destructioningredient',
+            name='value',
+            field=models.FloatField(blank=True, help_text='Если не указано, списывается весь остаток партии', null=True, verbose_name='Количество'),
+        ),
+        migrations.RunPython(fill_ingredient_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:30
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_daily_sales_rollup(apps, schema_editor):
+    Order = apps.get_model('cafe', 'Order')
+    DailySalesRollup = apps.get_model('cafe', 'DailySalesRollup')
+    days = Order.objects.annotate(
+        date=TruncDate('created_at')
+    ).values('date').annotate(
+        revenue=Sum('price'),
+        cost=Sum('cost'),
+        order_count=Count('id')
+    ).order_by('date')
+    DailySalesRollup.objects.bulk_create(
+        DailySalesRollup(**day) for day in days
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0008_ingredientstock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('revenue', models.FloatField(default=0, verbose_name='Выручка')),
+                ('cost', models.FloatField(default=0, verbose_name='Закупка')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='Кол-во чеков')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'ordering': ('date',),
+            },
+        ),
+        migrations.RunPython(fill_daily_sales_rollup, migrations.RunPython.noop),
+    ]
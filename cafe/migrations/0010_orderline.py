@@ -0,0 +1,65 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_order_lines(apps, schema_editor):
+    # prices were not recorded before, so lines get the current product
+    # prices and the order cost is split proportionally to them
+    Order = apps.get_model('cafe', 'Order')
+    OrderLine = apps.get_model('cafe', 'OrderLine')
+    orders = Order.objects.prefetch_related(
+        'basket__items__product').order_by('id')
+    last_id = 0
+    while batch := list(orders.filter(id__gt=last_id)[:1000]):
+        last_id = batch[-1].id
+        lines = []
+        for order in batch:
+            items = order.basket.items.all()
+            revenue = sum(item.count * item.product.price for item in items)
+            for item in items:
+                share = item.product.price / revenue if revenue else 0
+                lines.append(OrderLine(
+                    order_id=order.id,
+                    product_id=item.product_id,
+                    category_id=item.product.category_id,
+                    created_at=order.created_at,
+                    count=item.count,
+                    unit_price=item.product.price,
+                    unit_cost=order.cost * share
+                ))
+        OrderLine.objects.bulk_create(lines)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0009_dailysalesrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(verbose_name='Дата заказа')),
+                ('count', models.PositiveSmallIntegerField(verbose_name='Количество')),
+                ('unit_price', models.FloatField(verbose_name='Цена')),
+                ('unit_cost', models.FloatField(verbose_name='Себестоимость')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='cafe.Category', verbose_name='Категория')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='cafe.Order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='cafe.Product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Строка заказа',
+                'verbose_name_plural': 'Строки заказов',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(fields=['created_at', 'product'], name='cafe_orderl_created_e159be_idx'),
+        ),
+        migrations.RunPython(fill_order_lines, migrations.RunPython.noop),
+    ]
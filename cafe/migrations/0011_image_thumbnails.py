@@ -0,0 +1,33 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0010_orderline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryimage',
+            name='thumbnail_jpeg',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='categoryimage',
+            name='thumbnail_webp',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail_jpeg',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail_webp',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
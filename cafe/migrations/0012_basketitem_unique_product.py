@@ -0,0 +1,39 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:40
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    # concurrent edits could add the same product to a basket twice,
+    # the duplicates are merged into the first item
+    BasketItem = apps.get_model('cafe', 'BasketItem')
+    duplicates = BasketItem.objects.values(
+        'basket_id', 'product_id'
+    ).annotate(
+        items=Count('id'),
+        first_id=Min('id'),
+        total=Sum('count')
+    ).filter(items__gt=1).order_by()
+    for duplicate in duplicates:
+        items = BasketItem.objects.filter(
+            basket_id=duplicate['basket_id'],
+            product_id=duplicate['product_id']
+        )
+        items.exclude(id=duplicate['first_id']).delete()
+        items.update(count=duplicate['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0011_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basketitem',
+            constraint=models.UniqueConstraint(fields=('basket', 'product'), name='unique_basket_product'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:41
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def close_old_baskets(apps, schema_editor):
+    # the latest basket of every user was the one in use
+    Basket = apps.get_model('cafe', 'Basket')
+    latest = Basket.objects.filter(
+        user_id=OuterRef('user_id')
+    ).order_by('-created_at', '-id').values('id')[:1]
+    Basket.objects.exclude(
+        id=Subquery(latest)
+    ).update(status='ordered')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0012_basketitem_unique_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='status',
+            field=models.CharField(choices=[('active', 'Активная'), ('ordered', 'Оформлена')], default='active', max_length=7, verbose_name='Статус'),
+        ),
+        migrations.RunPython(close_old_baskets, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='basket',
+            index=models.Index(fields=['user', 'status'], name='cafe_basket_user_id_47a12a_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='basket',
+            constraint=models.UniqueConstraint(condition=models.Q(status='active'), fields=('user',), name='unique_active_basket'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cafe', '0013_basket_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='destructioningredient',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='users', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='shipment',
+            name='shelf_life',
+            field=models.DateTimeField(db_index=True, verbose_name='Срок годности'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0014_expiry_write_off'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('on_hand', models.FloatField(verbose_name='Остаток')),
+                ('min_balance', models.FloatField(verbose_name='Минимальный остаток')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('notified_at', models.DateTimeField(blank=True, null=True, verbose_name='Оповещение отправлено')),
+                ('resolved_at', models.DateTimeField(blank=True, null=True, verbose_name='Пополнено')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='cafe.Ingredient', verbose_name='Ингридиент')),
+            ],
+            options={
+                'verbose_name': 'Оповещение об остатке',
+                'verbose_name_plural': 'Оповещения об остатках',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stockalert',
+            constraint=models.UniqueConstraint(condition=models.Q(resolved_at__isnull=True), fields=('ingredient',), name='unique_open_stock_alert'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0015_stockalert'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='client_key',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True, verbose_name='Ключ терминала'),
+        ),
+    ]
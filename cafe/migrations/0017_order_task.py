@@ -0,0 +1,31 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0016_order_client_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Выполнить после')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')),
+                ('last_error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='task', to='cafe.Order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Задача заказа',
+                'verbose_name_plural': 'Задачи заказов',
+                'ordering': ('id',),
+            },
+        ),
+    ]
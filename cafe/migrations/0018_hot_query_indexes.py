@@ -0,0 +1,29 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0017_order_task'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='cafe_order_created_66ed3a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(published=True), fields=['category', 'title'], name='cafe_product_menu'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['ingredient', 'date'], name='cafe_shipme_ingredi_f809a3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='warehouse',
+            index=models.Index(condition=models.Q(value__gt=0), fields=['shipment'], name='cafe_warehouse_in_stock'),
+        ),
+    ]
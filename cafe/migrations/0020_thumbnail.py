@@ -0,0 +1,36 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+def forget_stored_thumbnails(apps, schema_editor):
+    # the thumbnails were files on the dyno, convert_base64_images builds
+    # them again in the database
+    for model_name in ('CategoryImage', 'ProductImage'):
+        apps.get_model('cafe', model_name).objects.update(
+            thumbnail_jpeg='', thumbnail_webp='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0018_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Thumbnail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('content_type', models.CharField(max_length=32)),
+                ('content', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'Миниатюра',
+                'verbose_name_plural': 'Миниатюры',
+            },
+        ),
+        migrations.RunPython(
+            forget_stored_thumbnails, migrations.RunPython.noop),
+    ]
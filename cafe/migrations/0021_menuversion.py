@@ -0,0 +1,24 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafe', '0020_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Версия меню',
+                'verbose_name_plural': 'Версии меню',
+            },
+        ),
+    ]
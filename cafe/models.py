@@ -1,10 +1,43 @@
 import base64
-
-from django.db import models
+import logging
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.dispatch import Signal
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
 from django.contrib.auth.models import User
 
+from cafe.bulk import bulk_create, create_with_ids
+from cafe.thumbnails import make_thumbnails
+
+logger = logging.getLogger(__name__)
+
+# sent after the commit with the ingredient_ids whose lots were added,
+# used up or written off, which moves the price of their stock
+stock_changed = Signal()
+
+
+class PrimaryImageMixin:
+    images_related_name = None
+
+    @property
+    def primary_image(self):
+        # set by Prefetch(..., to_attr='prefetched_images') in the services
+        if hasattr(self, 'prefetched_images'):
+            return next(iter(self.prefetched_images), None)
+        return getattr(self, self.images_related_name).order_by('id').first()
+
+
+class Category(PrimaryImageMixin, models.Model):
+    images_related_name = 'images_category'
 
-class Category(models.Model):
     title = models.CharField(
         max_length=50,
         unique=True,
@@ -21,26 +54,75 @@ class Category(models.Model):
         return self.title
 
 
-class Base64ImageMixin:
+class ThumbnailImageMixin:
     def save(self, *args, **kwargs):
-        if self.image:
+        if self.image and not self.image._committed:
+            self.image.open()
+            content = self.image.read()
+            self.image.seek(0)
+            # the inline copy is the durable original, see Thumbnail
             self.image_base64 = 'data:{content_type};base64,{data}'.format(
                 content_type='jpeg',
-                data=base64.b64encode(
-                    self.image.file.read()
-                ).decode()
+                data=base64.b64encode(content).decode()
             )
+            self.set_thumbnails(BytesIO(content))
         super().save(*args, **kwargs)
 
+    def set_thumbnails(self, image_file):
+        thumbnails = make_thumbnails(image_file, self.THUMBNAIL_SIZE)
+        Thumbnail.objects.bulk_create(
+            (
+                Thumbnail(name=name, content_type=content_type,
+                          content=content)
+                for name, content_type, content in thumbnails.values()
+            ),
+            ignore_conflicts=True
+        )
+        self.thumbnail_jpeg = thumbnails['jpg'][0]
+        self.thumbnail_webp = thumbnails['webp'][0]
+
     @property
     def image_url(self):
+        if self.thumbnail_jpeg:
+            return reverse('thumbnail', args=[self.thumbnail_jpeg])
+        # not converted yet, see convert_base64_images
         return self.image_base64 or self.image.url
 
+    @property
+    def webp_url(self):
+        if self.thumbnail_webp:
+            return reverse('thumbnail', args=[self.thumbnail_webp])
+        return None
+
+
+# referenced by old migrations
+Base64ImageMixin = ThumbnailImageMixin
+
+
+class Thumbnail(models.Model):
+    """Image thumbnail served by ThumbnailView.
+
+    Kept in the database like the images themselves, the file storage is
+    not shared between dynos and does not survive a restart.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    content_type = models.CharField(max_length=32)
+    content = models.BinaryField()
+
+    class Meta:
+        verbose_name = 'Миниатюра'
+        verbose_name_plural = 'Миниатюры'
+
+
+class CategoryImage(ThumbnailImageMixin, models.Model):
+    THUMBNAIL_SIZE = (320, 200)
 
-class CategoryImage(Base64ImageMixin, models.Model):
     description = models.TextField()
     image = models.ImageField(upload_to='categories/%Y/%m/%d/')
+    # legacy inline copy of the image, see convert_base64_images
     image_base64 = models.TextField(default=None, null=True, blank=True)
+    thumbnail_jpeg = models.CharField(max_length=255, blank=True)
+    thumbnail_webp = models.CharField(max_length=255, blank=True)
     category = models.ForeignKey(
         'cafe.Category',
         related_name='images_category',
@@ -79,6 +161,30 @@ class Ingredient(models.Model):
         return self.title
 
 
+class ShipmentManager(models.Manager):
+    def receive(self, shipments):
+        """Creates ``shipments`` with their warehouse lots and balances.
+
+        The number of queries does not depend on the number of shipments,
+        everything is written in one transaction.
+        """
+        changes = {}
+        with transaction.atomic():
+            shipments = create_with_ids(self.model, shipments)
+            bulk_create(Warehouse, (
+                Warehouse(shipment_id=shipment.id, value=shipment.value)
+                for shipment in shipments
+            ))
+            for shipment in shipments:
+                value, cost = changes.get(shipment.ingredient_id, (0, 0))
+                changes[shipment.ingredient_id] = (
+                    value + shipment.value,
+                    cost + shipment.value * shipment.price
+                )
+            IngredientStock.objects.apply(changes)
+        return shipments
+
+
 class Shipment(models.Model):
     date = models.DateTimeField(verbose_name='Дата поставки', auto_now_add=True)
     ingredient = models.ForeignKey(
@@ -89,18 +195,33 @@ class Shipment(models.Model):
     )
     value = models.FloatField(verbose_name='Количество')
     price = models.FloatField(verbose_name='Цена')
-    shelf_life = models.DateTimeField(verbose_name='Срок годности')
+    shelf_life = models.DateTimeField(
+        verbose_name='Срок годности',
+        db_index=True
+    )
+
+    objects = ShipmentManager()
 
     class Meta:
         verbose_name = 'Поставка'
         verbose_name_plural = 'Поставки'
         get_latest_by = 'date'
         ordering = ('date',)
+        indexes = [
+            # the lots of an ingredient in the order checkout takes them
+            models.Index(fields=['ingredient', 'date']),
+        ]
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        shipment = Shipment.objects.latest('date')
-        Warehouse.objects.create(shipment=shipment, value=shipment.value)
+        if self._state.adding:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                Warehouse.objects.create(shipment=self, value=self.value)
+                IngredientStock.objects.apply({
+                    self.ingredient_id: (self.value, self.value * self.price)
+                })
+        else:
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return self.ingredient.title
@@ -118,12 +239,234 @@ class Warehouse(models.Model):
     class Meta:
         verbose_name = 'Склад'
         verbose_name_plural = 'Склады'
+        indexes = [
+            # depleted lots kept for the write-off history are left out
+            models.Index(
+                fields=['shipment'],
+                condition=models.Q(value__gt=0),
+                name='cafe_warehouse_in_stock'
+            ),
+        ]
 
     def __str__(self):
         return self.shipment.ingredient.title
 
 
-class Product(models.Model):
+class IngredientStockManager(models.Manager):
+    def apply(self, changes, repriced=None):
+        """Applies ``changes`` (ingredient -> (value, cost)) to the balances.
+
+        Balances are changed relatively, in two statements regardless of the
+        number of ingredients, so concurrent writers do not lose updates.
+        ``repriced`` are the ingredients whose lot prices moved, all of
+        ``changes`` by default.
+        """
+        if not changes:
+            return
+        self.bulk_create(
+            (IngredientStock(ingredient_id=ingredient_id)
+             for ingredient_id in changes),
+            ignore_conflicts=True
+        )
+        stocks = []
+        for ingredient_id, (value, cost) in sorted(changes.items()):
+            stock_value = F('on_hand') * F('weighted_cost') + cost
+            stocks.append(IngredientStock(
+                ingredient_id=ingredient_id,
+                on_hand=F('on_hand') + value,
+                weighted_cost=Case(
+                    When(
+                        on_hand__gt=self.model.EPSILON - value,
+                        then=stock_value / (F('on_hand') + value)
+                    ),
+                    default=Value(0.0)
+                )
+            ))
+        self.bulk_update(stocks, ['on_hand', 'weighted_cost'])
+        # the thresholds and the costs are checked after the commit,
+        # outside the locks
+        ingredient_ids = list(changes)
+        transaction.on_commit(
+            lambda: StockAlert.objects.notify(ingredient_ids))
+        repriced = ingredient_ids if repriced is None else list(repriced)
+        if repriced:
+            transaction.on_commit(lambda: stock_changed.send(
+                sender=IngredientStock, ingredient_ids=repriced))
+
+    def calculate(self):
+        """Returns balances calculated from the warehouse lots."""
+        lots = Warehouse.objects.filter(value__gt=0).values(
+            'shipment__ingredient_id'
+        ).annotate(
+            on_hand=Sum('value'),
+            stock_value=Sum(
+                F('value') * F('shipment__price'),
+                output_field=models.FloatField()
+            )
+        ).order_by()
+        stocks = {
+            ingredient_id: IngredientStock(ingredient_id=ingredient_id)
+            for ingredient_id in Ingredient.objects.values_list(
+                'id', flat=True)
+        }
+        for lot in lots:
+            stock = stocks[lot['shipment__ingredient_id']]
+            stock.on_hand = lot['on_hand']
+            stock.weighted_cost = lot['stock_value'] / lot['on_hand']
+        return stocks
+
+
+class IngredientStock(models.Model):
+    # balances below this value are treated as float noise
+    EPSILON = 1e-9
+
+    ingredient = models.OneToOneField(
+        'cafe.Ingredient',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stock',
+        verbose_name='Ингридиент'
+    )
+    on_hand = models.FloatField(default=0, verbose_name='Остаток')
+    weighted_cost = models.FloatField(
+        default=0,
+        verbose_name='Средневзвешенная цена'
+    )
+
+    objects = IngredientStockManager()
+
+    class Meta:
+        verbose_name = 'Остаток ингридиента'
+        verbose_name_plural = 'Остатки ингридиентов'
+
+    def __str__(self):
+        return str(self.ingredient)
+
+    @property
+    def is_low(self):
+        return self.on_hand < self.ingredient.notify_min_balance
+
+
+class StockAlertManager(models.Manager):
+    def evaluate(self, ingredient_ids):
+        """Returns the alerts to send for ``ingredient_ids``.
+
+        Only the given ingredients are checked. An ingredient below its
+        minimum balance gets one open alert that is sent again after
+        CAFE_STOCK_ALERT_INTERVAL, the alert is closed by a restock.
+        """
+        low = {
+            stock.ingredient_id: stock
+            for stock in IngredientStock.objects.filter(
+                ingredient_id__in=ingredient_ids
+            ).select_related('ingredient')
+            if stock.is_low
+        }
+        now = timezone.now()
+        self.filter(
+            ingredient_id__in=ingredient_ids, resolved_at__isnull=True
+        ).exclude(ingredient_id__in=list(low)).update(resolved_at=now)
+        if not low:
+            return []
+
+        open_alerts = self.filter(
+            ingredient_id__in=list(low), resolved_at__isnull=True)
+        alerts = {alert.ingredient_id: alert for alert in open_alerts}
+        if len(alerts) < len(low):
+            # a concurrent check may have opened some of them
+            self.bulk_create((
+                StockAlert(
+                    ingredient_id=ingredient_id,
+                    on_hand=stock.on_hand,
+                    min_balance=stock.ingredient.notify_min_balance
+                )
+                for ingredient_id, stock in low.items()
+                if ingredient_id not in alerts
+            ), ignore_conflicts=True)
+            alerts = {
+                alert.ingredient_id: alert for alert in open_alerts.all()}
+
+        due = []
+        repeat_before = now - timedelta(
+            seconds=settings.CAFE_STOCK_ALERT_INTERVAL)
+        for ingredient_id, alert in sorted(alerts.items()):
+            if alert.notified_at and alert.notified_at > repeat_before:
+                continue
+            stock = low[ingredient_id]
+            # the alert is sent by whoever manages to mark it
+            if self.filter(
+                    Q(notified_at__isnull=True) |
+                    Q(notified_at__lte=repeat_before),
+                    id=alert.id
+            ).update(notified_at=now, on_hand=stock.on_hand):
+                alert.notified_at = now
+                alert.on_hand = stock.on_hand
+                alert.ingredient = stock.ingredient
+                due.append(alert)
+        return due
+
+    def notify(self, ingredient_ids):
+        """Sends the due alerts with every CAFE_STOCK_ALERT_BACKENDS."""
+        try:
+            alerts = self.evaluate(ingredient_ids)
+        except Exception:
+            # the stock changes are committed already
+            logger.exception('Could not check the stock thresholds')
+            return
+        if not alerts:
+            return
+        for path in settings.CAFE_STOCK_ALERT_BACKENDS:
+            try:
+                import_string(path)().send(alerts)
+            except Exception:
+                logger.exception('Stock alert backend %s failed', path)
+
+
+class StockAlert(models.Model):
+    ingredient = models.ForeignKey(
+        'cafe.Ingredient',
+        on_delete=models.CASCADE,
+        related_name='stock_alerts',
+        verbose_name='Ингридиент'
+    )
+    on_hand = models.FloatField(verbose_name='Остаток')
+    min_balance = models.FloatField(verbose_name='Минимальный остаток')
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата'
+    )
+    notified_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Оповещение отправлено'
+    )
+    resolved_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Пополнено'
+    )
+
+    objects = StockAlertManager()
+
+    class Meta:
+        verbose_name = 'Оповещение об остатке'
+        verbose_name_plural = 'Оповещения об остатках'
+        ordering = ('-created_at', )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('ingredient', ),
+                condition=models.Q(resolved_at__isnull=True),
+                name='unique_open_stock_alert'
+            ),
+        )
+
+    def __str__(self):
+        return str(self.ingredient)
+
+
+class Product(PrimaryImageMixin, models.Model):
+    images_related_name = 'images_product'
+
     title = models.CharField(
         max_length=100,
         unique=True,
@@ -142,15 +485,28 @@ class Product(models.Model):
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
         ordering = ('title',)
+        indexes = [
+            # the menu of a category, unpublished drafts are left out
+            models.Index(
+                fields=['category', 'title'],
+                condition=models.Q(published=True),
+                name='cafe_product_menu'
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
 
-class ProductImage(Base64ImageMixin, models.Model):
+class ProductImage(ThumbnailImageMixin, models.Model):
+    THUMBNAIL_SIZE = (240, 240)
+
     description = models.TextField()
     image = models.ImageField(upload_to='products/%Y/%m/%d/')
+    # legacy inline copy of the image, see convert_base64_images
     image_base64 = models.TextField(default=None, null=True, blank=True)
+    thumbnail_jpeg = models.CharField(max_length=255, blank=True)
+    thumbnail_webp = models.CharField(max_length=255, blank=True)
     product = models.ForeignKey(
         'cafe.Product',
         related_name='images_product',
@@ -158,6 +514,19 @@ class ProductImage(Base64ImageMixin, models.Model):
     )
 
 
+class MenuVersion(models.Model):
+    """Number of the menu changes, the single row has id 1.
+
+    Every web process caches the menu under this number, so a change made
+    in one process reaches the others whatever cache backend they use.
+    """
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Версия меню'
+        verbose_name_plural = 'Версии меню'
+
+
 class ProductIngredient(models.Model):
     product = models.ForeignKey(
         'cafe.Product',
@@ -182,12 +551,23 @@ class ProductIngredient(models.Model):
 
 
 class Basket(models.Model):
+
+    class Status(models.TextChoices):
+        ACTIVE = 'active', 'Активная'
+        ORDERED = 'ordered', 'Оформлена'
+
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='baskets'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(
+        max_length=7,
+        choices=Status.choices,
+        default=Status.ACTIVE,
+        verbose_name='Статус'
+    )
 
     def __str__(self):
         return f'Корзина {self.user}'
@@ -196,9 +576,53 @@ class Basket(models.Model):
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
         get_latest_by = 'created_at'
+        indexes = [
+            models.Index(fields=['user', 'status']),
+        ]
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', ),
+                condition=models.Q(status='active'),
+                name='unique_active_basket'
+            ),
+        )
+
+
+class BasketItemManager(models.Manager):
+    def add(self, basket_id, product_id, count):
+        """Adds ``count`` of the product to the basket in one statement."""
+        table = self.model._meta.db_table
+        total = f'{table}.count + EXCLUDED.count'
+        with connection.cursor() as cursor:
+            # the sum is capped, repeated adds must not overflow the column
+            cursor.execute(
+                f'INSERT INTO {table} (basket_id, product_id, count) '
+                f'VALUES (%s, %s, %s) '
+                f'ON CONFLICT (basket_id, product_id) '
+                f'DO UPDATE SET count = CASE WHEN {total} > %s THEN %s '
+                f'ELSE {total} END',
+                [basket_id, product_id, count, self.model.MAX_COUNT,
+                 self.model.MAX_COUNT]
+            )
+
+    def remove(self, basket_id, product_id, count):
+        """Removes ``count`` of the product, deleting the item at zero."""
+        items = self.filter(basket_id=basket_id, product_id=product_id)
+        # a concurrent edit may change the count between the statements,
+        # in that case the delete or the update is tried again
+        while True:
+            deleted, _ = items.filter(count__lte=count).delete()
+            if deleted or items.filter(count__gt=count).update(
+                    count=F('count') - count):
+                return
+            if not items.exists():
+                return
 
 
 class BasketItem(models.Model):
+    # the most of one product a basket holds
+    MAX_COUNT = 999
+
     basket = models.ForeignKey(
         'cafe.Basket',
         related_name='items',
@@ -215,10 +639,18 @@ class BasketItem(models.Model):
         verbose_name='Количество'
     )
 
+    objects = BasketItemManager()
+
     class Meta:
         verbose_name = 'Продукт в корзине'
         verbose_name_plural = 'Продукты в корзине'
         ordering = ('id', )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('basket', 'product'),
+                name='unique_basket_product'
+            ),
+        )
 
 
 class Order(models.Model):
@@ -230,18 +662,208 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     price = models.FloatField(verbose_name='Продажа', default=0)
     cost = models.FloatField(verbose_name='Закупка', default=0)
+    # idempotency key of an order queued by an offline terminal
+    client_key = models.UUIDField(
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        verbose_name='Ключ терминала'
+    )
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'заказы'
         ordering = ('created_at',)
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+
+class OrderTaskManager(models.Manager):
+    def due(self):
+        return self.filter(
+            run_after__lte=timezone.now(),
+            attempts__lt=self.model.MAX_ATTEMPTS
+        ).order_by('id')
+
+
+class OrderTask(models.Model):
+    """Order whose stock is left to the run_cafe_worker."""
+
+    # tasks that failed this many times wait for a developer
+    MAX_ATTEMPTS = 5
+
+    order = models.OneToOneField(
+        'cafe.Order',
+        on_delete=models.CASCADE,
+        related_name='task',
+        verbose_name='Заказ'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Выполнить после'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попытки'
+    )
+    last_error = models.TextField(blank=True, verbose_name='Ошибка')
+
+    objects = OrderTaskManager()
+
+    class Meta:
+        verbose_name = 'Задача заказа'
+        verbose_name_plural = 'Задачи заказов'
+        ordering = ('id', )
+
+    def __str__(self):
+        return f'Заказ {self.order_id}'
+
+    @staticmethod
+    def retry_delay(attempts):
+        return timedelta(seconds=10 * 2 ** attempts)
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(
+        'cafe.Order',
+        on_delete=models.CASCADE,
+        related_name='lines'
+    )
+    product = models.ForeignKey(
+        'cafe.Product',
+        on_delete=models.CASCADE,
+        related_name='order_lines',
+        verbose_name='Продукт'
+    )
+    category = models.ForeignKey(
+        'cafe.Category',
+        on_delete=models.CASCADE,
+        related_name='order_lines',
+        verbose_name='Категория'
+    )
+    created_at = models.DateTimeField(verbose_name='Дата заказа')
+    count = models.PositiveSmallIntegerField(verbose_name='Количество')
+    unit_price = models.FloatField(verbose_name='Цена')
+    unit_cost = models.FloatField(verbose_name='Себестоимость')
+
+    class Meta:
+        verbose_name = 'Строка заказа'
+        verbose_name_plural = 'Строки заказов'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['created_at', 'product']),
+        ]
+
+
+class DailySalesRollupManager(models.Manager):
+    def add_orders(self, orders):
+        """Adds ``orders`` to their days, one update per day."""
+        days = {}
+        for order in orders:
+            date = timezone.localdate(order.created_at)
+            revenue, cost, count = days.get(date, (0, 0, 0))
+            days[date] = (revenue + order.price, cost + order.cost, count + 1)
+        self.bulk_create(
+            (DailySalesRollup(date=date) for date in days),
+            ignore_conflicts=True
+        )
+        for date, (revenue, cost, count) in sorted(days.items()):
+            self.filter(date=date).update(
+                revenue=F('revenue') + revenue,
+                cost=F('cost') + cost,
+                order_count=F('order_count') + count
+            )
+
+    def aggregate_orders(self, orders):
+        """Returns daily totals of ``orders`` calculated by the database."""
+        return orders.annotate(
+            date=TruncDate('created_at')
+        ).values('date').annotate(
+            revenue=Sum('price'),
+            cost=Sum('cost'),
+            order_count=Count('id')
+        ).order_by('date')
+
+    def rebuild(self, orders):
+        rollups = [
+            DailySalesRollup(**day) for day in self.aggregate_orders(orders)
+        ]
+        self.filter(date__in=[rollup.date for rollup in rollups]).delete()
+        self.bulk_create(rollups)
+        return rollups
+
+
+class DailySalesRollup(models.Model):
+    date = models.DateField(unique=True, verbose_name='Дата')
+    revenue = models.FloatField(default=0, verbose_name='Выручка')
+    cost = models.FloatField(default=0, verbose_name='Закупка')
+    order_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Кол-во чеков'
+    )
+
+    objects = DailySalesRollupManager()
+
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Продажи по дням'
+        ordering = ('date',)
+
+    def __str__(self):
+        return str(self.date)
+
+
+class DestructionIngredientManager(models.Manager):
+    def write_off_expired(self, batch_size, user=None):
+        """Writes off the remaining value of lots past their shelf life.
+
+        Lots are processed in batches of ``batch_size``, each in its own
+        transaction, so memory use and lock time do not depend on the
+        number of expired lots. Returns the number of written off lots.
+        """
+        now = timezone.now()
+        expired = Warehouse.objects.filter(
+            value__gt=0, shipment__shelf_life__lte=now
+        ).order_by('shipment__shelf_life', 'id')
+        total = 0
+        while True:
+            with transaction.atomic():
+                lots = list(expired.select_for_update(
+                    skip_locked=True, of=('self',)
+                ).select_related('shipment')[:batch_size])
+                if not lots:
+                    return total
+                self.bulk_create(
+                    DestructionIngredient(
+                        user=user, warehouse_id=lot.id, value=lot.value)
+                    for lot in lots
+                )
+                # the lots are zeroed instead of deleted to keep the records
+                Warehouse.objects.filter(
+                    id__in=[lot.id for lot in lots]).update(value=0)
+                changes = {}
+                for lot in lots:
+                    value, cost = changes.get(
+                        lot.shipment.ingredient_id, (0, 0))
+                    changes[lot.shipment.ingredient_id] = (
+                        value - lot.value,
+                        cost - lot.value * lot.shipment.price
+                    )
+                IngredientStock.objects.apply(changes)
+            total += len(lots)
 
 
 class DestructionIngredient(models.Model):
     date = models.DateTimeField(auto_now_add=True)
+    # write-offs of expired lots are made by the system without a user
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        null=True,
+        blank=True,
         related_name='users'
     )
     warehouse = models.ForeignKey(
@@ -249,7 +871,41 @@ class DestructionIngredient(models.Model):
         on_delete=models.CASCADE,
         related_name='warehouses'
     )
+    value = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name='Количество',
+        help_text='Если не указано, списывается весь остаток партии'
+    )
+
+    objects = DestructionIngredientManager()
 
     class Meta:
         verbose_name = 'Списание продукта'
         verbose_name_plural = 'Списание продуктов'
+
+    def clean(self):
+        # a negative write-off would add the value back to the lot and a
+        # zero one would record nothing
+        if self.value is not None and self.value <= 0:
+            raise ValidationError(
+                {'value': 'Количество должно быть больше нуля'})
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.clean()
+            with transaction.atomic():
+                warehouse = Warehouse.objects.select_for_update(
+                ).select_related('shipment').get(id=self.warehouse_id)
+                # the lot is zeroed instead of deleted to keep this record
+                if self.value is None or self.value > warehouse.value:
+                    self.value = warehouse.value
+                warehouse.value -= self.value
+                warehouse.save(update_fields=['value'])
+                IngredientStock.objects.apply({
+                    warehouse.shipment.ingredient_id: (
+                        -self.value, -self.value * warehouse.shipment.price)
+                })
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
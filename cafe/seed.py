@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from cafe.bulk import bulk_create, create_with_ids
+from cafe.models import Basket, BasketItem, Category, DailySalesRollup, \
+    Ingredient, Order, OrderLine, Product, ProductIngredient, Shipment
+
+
+@contextmanager
+def historical_dates(*models):
+    """Lets ``created_at`` of the models be set instead of the time now."""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def seed_catalog(rng, prefix, categories, products, ingredients,
+                 ingredients_per_product):
+    category_objs = create_with_ids(Category, (
+        Category(title=f'{prefix} {i}', slug=f'{prefix}-{i}')
+        for i in range(categories)
+    ))
+    ingredient_objs = create_with_ids(Ingredient, (
+        Ingredient(title=f'{prefix} {i}') for i in range(ingredients)
+    ))
+    product_objs = create_with_ids(Product, (
+        Product(
+            title=f'{prefix} {i}',
+            price=round(rng.uniform(1.5, 9), 1),
+            cost=round(rng.uniform(0.5, 1.5), 2),
+            published=True,
+            category=rng.choice(category_objs)
+        )
+        for i in range(products)
+    ))
+    per_product = min(ingredients_per_product, len(ingredient_objs))
+    bulk_create(ProductIngredient, (
+        ProductIngredient(
+            product=product,
+            ingredient=ingredient,
+            value=round(rng.uniform(0.01, 0.3), 3)
+        )
+        for product in product_objs
+        for ingredient in rng.sample(ingredient_objs, per_product)
+    ))
+    return product_objs, ingredient_objs
+
+
+def seed_stock(rng, ingredients, lots):
+    now = timezone.now()
+    return Shipment.objects.receive(
+        Shipment(
+            ingredient=rng.choice(ingredients),
+            value=rng.randint(10, 100),
+            price=round(rng.uniform(1, 20), 2),
+            shelf_life=now + timedelta(days=rng.randint(1, 180))
+        )
+        for _ in range(lots)
+    )
+
+
+def seed_orders(rng, users, products, days, orders_per_day, max_items=4,
+                progress=None):
+    """Creates closed baskets with orders for the last ``days`` days.
+
+    ``progress`` is called with the date after every seeded day.
+    """
+    today = timezone.localdate()
+    start = timezone.make_aware(
+        datetime.combine(today - timedelta(days=days), time.min))
+    with historical_dates(Basket, Order):
+        for day in range(days, 0, -1):
+            date = today - timedelta(days=day)
+            seed_day(rng, users, products, date, orders_per_day, max_items)
+            if progress:
+                progress(date)
+    DailySalesRollup.objects.rebuild(
+        Order.objects.filter(created_at__gte=start))
+
+
+def seed_day(rng, users, products, date, orders_per_day, max_items):
+    # models are built from ids rather than related objects, assigning
+    # related objects is the slowest part of creating millions of rows
+    opened = timezone.make_aware(datetime.combine(date, time(8)))
+    times = sorted(
+        opened + timedelta(seconds=rng.randint(0, 12 * 3600))
+        for _ in range(orders_per_day)
+    )
+    baskets = create_with_ids(Basket, (
+        Basket(user_id=rng.choice(users).id, created_at=created_at,
+               status=Basket.Status.ORDERED)
+        for created_at in times
+    ))
+    contents = [
+        (basket, [(product, rng.randint(1, 3)) for product in rng.sample(
+            products, rng.randint(1, max_items))])
+        for basket in baskets
+    ]
+    bulk_create(BasketItem, (
+        BasketItem(basket_id=basket.id, product_id=product.id, count=count)
+        for basket, items in contents
+        for product, count in items
+    ))
+    orders = create_with_ids(Order, (
+        Order(
+            basket_id=basket.id,
+            created_at=basket.created_at,
+            price=round(sum(
+                round(count * product.price, 2) for product, count in items
+            ), 2),
+            cost=round(sum(
+                round(count * product.cost, 2) for product, count in items
+            ), 2)
+        )
+        for basket, items in contents
+    ))
+    bulk_create(OrderLine, (
+        OrderLine(
+            order_id=order.id,
+            product_id=product.id,
+            category_id=product.category_id,
+            created_at=order.created_at,
+            count=count,
+            unit_price=product.price,
+            unit_cost=product.cost
+        )
+        for order, (_, items) in zip(orders, contents)
+        for product, count in items
+    ))
@@ -1,37 +1,699 @@
-from cafe.models import Basket, Category, Product
+import logging
+import traceback
+from collections import defaultdict, deque
+from contextlib import suppress
+from datetime import datetime, time, timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError, OperationalError
+from django.db.models import Count, F, FloatField, OuterRef, Prefetch, Q, \
+    Subquery, Sum, Window, prefetch_related_objects
+from django.db.models.functions import ExtractHour, Rank
+from django.utils import timezone
+
+from cafe.bulk import chunked
+from cafe.models import Basket, BasketItem, Category, Product, \
+    ProductIngredient, Warehouse, Ingredient, Shipment, Order, \
+    IngredientStock, DailySalesRollup, OrderLine, CategoryImage, \
+    ProductImage, OrderTask, MenuVersion
+
+logger = logging.getLogger(__name__)
 
 
 def get_categories_pr_images():
-    return Category.objects.prefetch_related('images_category')
+    return Category.objects.prefetch_related(Prefetch(
+        'images_category',
+        queryset=CategoryImage.objects.defer('image_base64').order_by('id'),
+        to_attr='prefetched_images'
+    ))
 
 
 def get_products_pr_images():
-    return Product.objects.filter(published=True).prefetch_related(
-        'images_product')
+    return Product.objects.filter(published=True).prefetch_related(Prefetch(
+        'images_product',
+        queryset=ProductImage.objects.defer('image_base64').order_by('id'),
+        to_attr='prefetched_images'
+    ))
+
+
+ACTIVE_BASKET_SESSION_KEY = 'cafe_basket_id'
+
+
+def open_basket(user_id):
+    basket, _ = Basket.objects.get_or_create(
+        user_id=user_id, status=Basket.Status.ACTIVE)
+    return basket
+
+
+def get_active_basket(request):
+    # the session keeps the basket id, so it is found by primary key
+    # instead of searching through all the baskets of the user
+    basket_id = request.session.get(ACTIVE_BASKET_SESSION_KEY)
+    if basket_id:
+        with suppress(Basket.DoesNotExist):
+            return Basket.objects.get(
+                id=basket_id,
+                user=request.user,
+                status=Basket.Status.ACTIVE
+            )
+    basket = open_basket(request.user.id)
+    request.session[ACTIVE_BASKET_SESSION_KEY] = basket.id
+    return basket
+
+
+def prefetch_basket_items(basket):
+    prefetch_related_objects([basket], Prefetch(
+        'items',
+        queryset=BasketItem.objects.select_related('product')
+    ))
+    return basket
+
+
+MENU_CACHE_PREFIX = 'cafe:menu'
+
+
+def get_menu_cache_key(name):
+    return f'{MENU_CACHE_PREFIX}:{name}'
+
+
+def count_menu_cache(event):
+    key = get_menu_cache_key(event)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_menu_version():
+    # the version is read from the database, the cache may be local to the
+    # process and evict it, either would serve the menu before a change
+    return MenuVersion.objects.filter(id=1).values_list(
+        'version', flat=True).first() or 0
+
+
+def invalidate_menu():
+    # cached parts of older versions are left to expire
+    if not MenuVersion.objects.filter(id=1).update(
+            version=F('version') + 1):
+        MenuVersion.objects.bulk_create(
+            [MenuVersion(id=1, version=1)], ignore_conflicts=True)
+
+
+def get_menu_cache_stats():
+    counts = cache.get_many(
+        [get_menu_cache_key(name) for name in ('hits', 'misses')])
+    stats = {
+        name: counts.get(get_menu_cache_key(name), 0)
+        for name in ('hits', 'misses')
+    }
+    stats['version'] = get_menu_version()
+    return stats
+
+
+def get_cached_menu(name, build):
+    key = get_menu_cache_key(f'{get_menu_version()}:{name}')
+    menu = cache.get(key)
+    if menu is None:
+        count_menu_cache('misses')
+        menu = build()
+        cache.set(key, menu, timeout=settings.CAFE_MENU_CACHE_TIMEOUT)
+    else:
+        count_menu_cache('hits')
+    return menu
 
 
-def get_basket_items_latest(user):
-    return Basket.objects.filter(
-        user=user
-    ).prefetch_related('items').latest()
+def get_menu_categories():
+    return get_cached_menu(
+        'categories', lambda: list(get_categories_pr_images()))
 
 
 def get_category_request(request):
-    return request.GET.get('category', Category.objects.first().slug)
+    if category := request.GET.get('category'):
+        return category
+    categories = get_menu_categories()
+    return categories[0].slug if categories else None
 
 
 def products_in_category(request):
-    products = get_products_pr_images()
-    if category := get_category_request(request):
-        products = products.filter(category__slug=category)
-    return products
+    category = get_category_request(request)
 
+    def build():
+        products = get_products_pr_images()
+        if category:
+            products = products.filter(category__slug=category)
+        return list(products)
 
-def isbasket_or_create(user):
-    if not Basket.objects.filter(user=user).exists():
-        Basket.objects.create(user=user)
+    return get_cached_menu(f'products:{category}', build)
+
+
+def edit_basket(basket, product_id, product_count):
+    if product_count > 0:
+        BasketItem.objects.add(basket.id, product_id, product_count)
+    else:
+        BasketItem.objects.remove(basket.id, product_id, -product_count)
+
+
+def serialize_basket(basket):
+    return {
+        'id': basket.id,
+        'items': [
+            {
+                'product_id': item.product_id,
+                'title': item.product.title,
+                'price': item.product.price,
+                'count': item.count,
+                'cost': round(item.count * item.product.price, 2)
+            }
+            for item in basket.items.all()
+        ],
+        'total_cost': get_total_cost_basket(basket)
+    }
 
 
 def get_total_cost_basket(basket):
     return round(
         sum(item.product.price * item.count for item in basket.items.all()), 2)
+
+
+def get_flow_charts(product_ids):
+    flow_charts = defaultdict(list)
+    for flow_chart in ProductIngredient.objects.filter(
+            product_id__in=product_ids).order_by('id'):
+        flow_charts[flow_chart.product_id].append(flow_chart)
+    return flow_charts
+
+
+STOCK_ORDERING = {
+    'fifo': ('shipment__date', 'shipment_id', 'id'),
+    'fefo': ('shipment__shelf_life', 'shipment__date', 'shipment_id', 'id'),
+}
+
+# consumption below this value is treated as float noise
+STOCK_EPSILON = 1e-9
+
+CHECKOUT_ATTEMPTS = 3
+DEADLOCK_DETECTED = '40P01'
+
+
+def get_stock_lots(ingredient_ids):
+    # expired lots are left for write_off_expired
+    return Warehouse.objects.filter(
+        shipment__ingredient_id__in=ingredient_ids,
+        shipment__shelf_life__gt=timezone.now(),
+        value__gt=0
+    ).order_by(*STOCK_ORDERING[settings.CAFE_STOCK_ORDERING])
+
+
+def stock_sort_key(warehouse):
+    shipment = warehouse.shipment
+    if settings.CAFE_STOCK_ORDERING == 'fefo':
+        return shipment.shelf_life, shipment.date, shipment.id, warehouse.id
+    return shipment.date, shipment.id, warehouse.id
+
+
+def lock_stock_lots(requirements):
+    """Locks the lots needed to cover ``requirements`` (ingredient -> value).
+
+    Only the head lots of each ingredient are locked. Lots held by
+    concurrent checkouts are skipped and the next free ones are taken in
+    their place, so baristas do not queue behind each other. A checkout
+    waits for the held lots only when no free lots are left.
+    """
+    lots = defaultdict(list)
+    seen = set()
+    skipped = set()
+    skip_locked = settings.CAFE_STOCK_SKIP_LOCKED
+    short = dict(requirements)
+    while short:
+        candidates = []
+        covered = defaultdict(float)
+        for lot_id, ingredient_id, value in get_stock_lots(short).exclude(
+                id__in=seen).values_list(
+                    'id', 'shipment__ingredient_id', 'value'):
+            if covered[ingredient_id] < short[ingredient_id]:
+                covered[ingredient_id] += value
+                candidates.append(lot_id)
+        if not candidates:
+            if not skipped:
+                # out of stock, the rest is recorded as a shortage
+                break
+            # only held lots are left, wait for them
+            skip_locked = False
+            seen -= skipped
+            skipped.clear()
+            continue
+        locked = set()
+        for warehouse in get_stock_lots(short).filter(
+                id__in=candidates
+        ).select_for_update(
+            skip_locked=skip_locked, of=('self',)
+        ).select_related('shipment'):
+            lots[warehouse.shipment.ingredient_id].append(warehouse)
+            locked.add(warehouse.id)
+        seen.update(candidates)
+        skipped.update(set(candidates) - locked)
+        short = {}
+        for ingredient_id, value in requirements.items():
+            on_hand = sum(lot.value for lot in lots[ingredient_id])
+            if on_hand < value:
+                short[ingredient_id] = value - on_hand
+    return defaultdict(deque, {
+        ingredient_id: deque(sorted(ingredient_lots, key=stock_sort_key))
+        for ingredient_id, ingredient_lots in lots.items()
+    })
+
+
+def consume_stock(lots, value):
+    """Takes ``value`` from the head of ``lots`` and returns its cost.
+
+    Returns the cost of the consumed part, the value that could not be
+    covered by stock and the lots that were consumed completely.
+    """
+    cost = 0
+    depleted = []
+    while lots and value > STOCK_EPSILON:
+        warehouse = lots[0]
+        taken = min(warehouse.value, value)
+        cost += taken * warehouse.shipment.price
+        value -= taken
+        warehouse.value -= taken
+        if warehouse.value <= STOCK_EPSILON:
+            depleted.append(lots.popleft())
+    return cost, max(value, 0), depleted
+
+
+def get_last_prices(ingredient_ids):
+    last_price = Shipment.objects.filter(
+        ingredient=OuterRef('pk')
+    ).order_by('-date').values('price')[:1]
+    return dict(
+        Ingredient.objects.filter(id__in=ingredient_ids).annotate(
+            last_price=Subquery(last_price)
+        ).values_list('id', 'last_price')
+    )
+
+
+def get_cost_lots(requirements):
+    """Returns (value, price) lots to price ``requirements`` from.
+
+    With the 'fifo' method these are the head lots that checkout consumes
+    next, with 'average' the whole balance at its weighted cost.
+    """
+    lots = defaultdict(list)
+    if settings.CAFE_PRODUCT_COST_METHOD == 'average':
+        for stock in IngredientStock.objects.filter(
+                ingredient_id__in=requirements, on_hand__gt=STOCK_EPSILON):
+            lots[stock.ingredient_id].append(
+                (stock.on_hand, stock.weighted_cost))
+        return lots
+    covered = defaultdict(float)
+    for ingredient_id, value, price in get_stock_lots(
+            requirements).values_list(
+                'shipment__ingredient_id', 'value', 'shipment__price'
+            ).iterator():
+        if covered[ingredient_id] < requirements[ingredient_id]:
+            covered[ingredient_id] += value
+            lots[ingredient_id].append((value, price))
+    return lots
+
+
+def price_requirement(lots, value, last_price):
+    cost = 0
+    for lot_value, price in lots:
+        if value <= STOCK_EPSILON:
+            break
+        taken = min(lot_value, value)
+        cost += taken * price
+        value -= taken
+    # the part that is not in stock is priced by the last purchase
+    return cost + max(value, 0) * (last_price or 0)
+
+
+def update_product_costs(ingredient_ids=None, product_ids=None):
+    """Recalculates Product.cost from the flow charts and the stock.
+
+    Only products using ``ingredient_ids`` or listed in ``product_ids``
+    are recalculated, every product if neither is given. Products are
+    processed in chunks so memory use does not grow with the catalog.
+    Returns the number of recalculated products.
+    """
+    if ingredient_ids is not None:
+        product_ids = set(ProductIngredient.objects.filter(
+            ingredient_id__in=ingredient_ids
+        ).values_list('product_id', flat=True))
+    elif product_ids is None:
+        product_ids = Product.objects.values_list('id', flat=True)
+    count = 0
+    for chunk in chunked(sorted(product_ids)):
+        flow_charts = get_flow_charts(chunk)
+        requirements = defaultdict(float)
+        for flow_chart in chain.from_iterable(flow_charts.values()):
+            requirements[flow_chart.ingredient_id] = max(
+                requirements[flow_chart.ingredient_id], flow_chart.value)
+        lots = get_cost_lots(requirements)
+        last_prices = get_last_prices(requirements)
+        Product.objects.bulk_update([
+            Product(id=product_id, cost=round(sum(
+                price_requirement(
+                    lots[flow_chart.ingredient_id],
+                    flow_chart.value,
+                    last_prices.get(flow_chart.ingredient_id)
+                )
+                for flow_chart in flow_charts[product_id]
+            ), 2))
+            for product_id in chunk
+        ], ['cost'])
+        count += len(chunk)
+    return count
+
+
+def is_deadlock(error):
+    return getattr(error.__cause__, 'pgcode', None) == DEADLOCK_DETECTED
+
+
+def checkout(basket, client_key=None, in_background=False):
+    # a checkout that waits for held lots may deadlock with the one
+    # holding them; the database aborts one of them and it is safe to run
+    # it again
+    for attempt in range(1, CHECKOUT_ATTEMPTS + 1):
+        try:
+            return checkout_basket(
+                basket, client_key=client_key, in_background=in_background)
+        except OperationalError as error:
+            if not is_deadlock(error) or attempt == CHECKOUT_ATTEMPTS:
+                raise
+
+
+@transaction.atomic
+def checkout_basket(basket, client_key=None, created_at=None,
+                    in_background=False):
+    """Checks out the active basket and returns the order.
+
+    A terminal retrying the checkout sends the same ``client_key`` and
+    gets the order created the first time. Returns None if the basket is
+    not active, it was checked out already.
+    """
+    # a repeated post waits for the lock and then finds the basket ordered
+    basket = Basket.objects.select_for_update().filter(id=basket.id).first()
+    if client_key:
+        order = Order.objects.filter(client_key=client_key).first()
+        if order:
+            return order
+    if basket is None or basket.status != Basket.Status.ACTIVE:
+        return None
+    order = place_order(basket, client_key, created_at, in_background)
+    DailySalesRollup.objects.add_orders([order])
+    return order
+
+
+def place_order(basket, client_key=None, created_at=None,
+                in_background=False):
+    """Creates the order of a locked basket and closes the basket.
+
+    With ``in_background`` the stock is left to the run_cafe_worker
+    process. The caller adds the order to the daily rollup as the last
+    statement of the same transaction: the report never misses an order,
+    and every checkout of the day locks that row only after its lots, for
+    the shortest time.
+    """
+    items = list(basket.items.select_related('product'))
+    order = record_order(basket, items, client_key, created_at)
+    if in_background:
+        OrderTask.objects.create(order=order)
+    else:
+        fulfil_orders([(item.product_id, item.count) for item in items])
+    return order
+
+
+def record_order(basket, items, client_key=None, created_at=None):
+    """Closes the basket and creates the order with its lines."""
+    order_sum = 0
+    order_cost = 0
+    for item in items:
+        order_sum += round(item.count * item.product.price, 2)
+        # the cost is kept current by update_product_costs
+        order_cost += round(item.count * item.product.cost, 2)
+    if items:
+        Basket.objects.filter(id=basket.id).update(
+            status=Basket.Status.ORDERED)
+        open_basket(basket.user_id)
+    order = Order.objects.create(
+        basket=basket,
+        price=order_sum,
+        cost=order_cost,
+        client_key=client_key
+    )
+    if created_at and created_at < order.created_at:
+        # the order was rung up by a terminal that was offline
+        order.created_at = created_at
+        Order.objects.filter(id=order.id).update(created_at=created_at)
+    OrderLine.objects.bulk_create(
+        OrderLine(
+            order=order,
+            product_id=item.product_id,
+            category_id=item.product.category_id,
+            created_at=order.created_at,
+            count=item.count,
+            unit_price=item.product.price,
+            unit_cost=item.product.cost
+        )
+        for item in items
+    )
+    return order
+
+
+def fulfil_orders(lines):
+    """Takes the ingredients of ``lines`` out of stock.
+
+    ``lines`` are (product_id, count) pairs of the orders.
+    """
+    lines = list(lines)
+    flow_charts = get_flow_charts({product_id for product_id, _ in lines})
+    requirements = defaultdict(float)
+    for product_id, count in lines:
+        for flow_chart in flow_charts[product_id]:
+            requirements[flow_chart.ingredient_id] += flow_chart.value * count
+    deduct_stock(requirements)
+
+
+def deduct_stock(requirements):
+    """Takes ``requirements`` (ingredient -> value) out of the lots."""
+    lots = lock_stock_lots(requirements)
+    changed_lots = []
+    depleted_lots = []
+    stock_changes = {}
+    repriced = []
+    for ingredient_id, value in requirements.items():
+        ingredient_lots = lots[ingredient_id]
+        cost, shortage, depleted = consume_stock(ingredient_lots, value)
+        stock_changes[ingredient_id] = (shortage - value, -cost)
+        depleted_lots += [warehouse.id for warehouse in depleted]
+        if depleted:
+            repriced.append(ingredient_id)
+        if ingredient_lots and shortage < value:
+            changed_lots.append(ingredient_lots[0])
+
+    if changed_lots:
+        Warehouse.objects.bulk_update(changed_lots, ['value'])
+    if depleted_lots:
+        # lots with write-off records are kept zeroed for the history
+        depleted = Warehouse.objects.filter(id__in=depleted_lots)
+        depleted.filter(warehouses__isnull=False).update(value=0)
+        depleted.filter(warehouses__isnull=True).delete()
+    # the product costs are priced by the head lots, only a used up lot
+    # moves them to the price of the next one
+    IngredientStock.objects.apply(stock_changes, repriced=repriced)
+
+
+def process_order_tasks(batch_size):
+    """Fulfils a batch of orders queued by checkout_basket.
+
+    Tasks are locked in the order they were queued without skipping the
+    locked ones, so concurrent workers take turns and every ingredient is
+    taken out of stock in the order the orders were placed. Returns the
+    number of processed tasks.
+    """
+    tasks = []
+    try:
+        with transaction.atomic():
+            tasks = list(OrderTask.objects.due().select_for_update(
+                of=('self', ))[:batch_size])
+            if not tasks:
+                return 0
+            fulfil_orders(
+                OrderLine.objects.filter(
+                    order__in=[task.order_id for task in tasks]
+                ).values_list('product_id', 'count')
+            )
+            OrderTask.objects.filter(
+                id__in=[task.id for task in tasks]).delete()
+    except Exception:
+        # one broken order must not hold up the rest of the batch
+        logger.exception('Order batch failed, processing it task by task')
+        for task in tasks:
+            process_order_task(task)
+    return len(tasks)
+
+
+def process_order_task(task):
+    try:
+        with transaction.atomic():
+            # another worker may have taken it after the batch failed
+            if not OrderTask.objects.due().select_for_update(
+                    of=('self', )).filter(id=task.id).exists():
+                return
+            fulfil_orders(OrderLine.objects.filter(
+                order_id=task.order_id).values_list('product_id', 'count'))
+            task.delete()
+    except Exception:
+        logger.exception('Order %s failed', task.order_id)
+        OrderTask.objects.filter(id=task.id).update(
+            attempts=F('attempts') + 1,
+            run_after=timezone.now() + OrderTask.retry_delay(task.attempts),
+            last_error=traceback.format_exc()
+        )
+
+
+def get_order_task_stats():
+    return OrderTask.objects.aggregate(
+        queued=Count('id', filter=Q(attempts__lt=OrderTask.MAX_ATTEMPTS)),
+        failed=Count('id', filter=Q(attempts__gte=OrderTask.MAX_ATTEMPTS))
+    )
+
+
+def sync_offline_orders(user, orders):
+    """Checks out orders queued by an offline terminal.
+
+    ``orders`` is a list of cleaned OfflineOrderForm data, the whole batch
+    is processed in one transaction. Returns a result per order key.
+    """
+    for attempt in range(1, CHECKOUT_ATTEMPTS + 1):
+        try:
+            return sync_orders_batch(user, orders)
+        except OperationalError as error:
+            if not is_deadlock(error) or attempt == CHECKOUT_ATTEMPTS:
+                raise
+
+
+def take_offline_basket(user, basket_id, items):
+    """Returns a basket with ``items`` (product -> count) to check out.
+
+    The active basket the terminal was editing is reused so that its
+    items do not show up again, other orders get a basket of their own.
+    """
+    basket = Basket.objects.select_for_update().filter(
+        id=basket_id, user=user, status=Basket.Status.ACTIVE).first()
+    if basket is None:
+        basket = Basket.objects.create(
+            user=user, status=Basket.Status.ORDERED)
+    else:
+        basket.items.all().delete()
+    BasketItem.objects.bulk_create(
+        BasketItem(basket=basket, product_id=product_id, count=count)
+        for product_id, count in items.items()
+    )
+    return basket
+
+
+@transaction.atomic
+def sync_orders_batch(user, orders):
+    # a terminal resends the orders whose response it did not get,
+    # the keys of the synced orders make the replays no-ops
+    synced = dict(Order.objects.filter(
+        client_key__in=[order['key'] for order in orders]
+    ).values_list('client_key', 'id'))
+    products = Product.objects.in_bulk(
+        {product_id for order in orders for product_id in order['items']})
+    results = {}
+    placed = []
+    for data in orders:
+        key = data['key']
+        if key in synced:
+            results[key] = {'status': 'duplicate', 'id': synced[key]}
+            continue
+        if not products.keys() >= data['items'].keys():
+            results[key] = {'status': 'invalid',
+                            'errors': {'items': ['Invalid product ID']}}
+            continue
+        try:
+            with transaction.atomic():
+                basket = take_offline_basket(
+                    user, data['basket_id'], data['items'])
+                order = place_order(
+                    basket,
+                    client_key=key,
+                    created_at=data['created_at'],
+                    in_background=settings.CAFE_CHECKOUT_IN_BACKGROUND
+                )
+        except IntegrityError:
+            # a concurrent request may have synced the same order, other
+            # conflicts leave it to the terminal to send it again
+            order_id = Order.objects.filter(client_key=key).values_list(
+                'id', flat=True).first()
+            if order_id is None:
+                results[key] = {
+                    'status': 'error',
+                    'errors': {'__all__': ['Order could not be saved']}
+                }
+            else:
+                results[key] = {'status': 'duplicate', 'id': order_id}
+            continue
+        placed.append(order)
+        synced[key] = order.id
+        results[key] = {'status': 'created', 'id': order.id}
+    DailySalesRollup.objects.add_orders(placed)
+    return results
+
+
+def get_datetime_range(from_date, to_date):
+    return (
+        timezone.make_aware(datetime.combine(from_date, time.min)),
+        timezone.make_aware(
+            datetime.combine(to_date + timedelta(days=1), time.min))
+    )
+
+
+def get_orders_in_range(from_date, to_date):
+    start, end = get_datetime_range(from_date, to_date)
+    return Order.objects.filter(created_at__gte=start, created_at__lt=end)
+
+
+def get_daily_sales(from_date, to_date):
+    today = timezone.localdate()
+    # closed days are read from the rollup, today is aggregated live
+    days = list(DailySalesRollup.objects.filter(
+        date__gte=from_date,
+        date__lte=min(to_date, today - timedelta(days=1))
+    ).values('date', 'revenue', 'cost', 'order_count'))
+    if from_date <= today <= to_date:
+        days += DailySalesRollup.objects.aggregate_orders(
+            get_orders_in_range(today, today))
+    return days
+
+
+ANALYTICS_GROUPS = {
+    'product': ('product__title', 'Продукт'),
+    'category': ('category__title', 'Категория'),
+    'hour': ('hour', 'Час'),
+}
+
+
+def get_sales_analytics(from_date, to_date, group_by):
+    field, _ = ANALYTICS_GROUPS[group_by]
+    revenue = Sum(F('count') * F('unit_price'), output_field=FloatField())
+    cost = Sum(F('count') * F('unit_cost'), output_field=FloatField())
+    start, end = get_datetime_range(from_date, to_date)
+    lines = OrderLine.objects.filter(created_at__gte=start, created_at__lt=end)
+    if group_by == 'hour':
+        lines = lines.annotate(hour=ExtractHour('created_at'))
+    return lines.values(group=F(field)).annotate(
+        quantity=Sum('count'),
+        revenue=revenue,
+        cost=cost,
+        margin=revenue - cost,
+        revenue_rank=Window(Rank(), order_by=revenue.desc()),
+        margin_rank=Window(Rank(), order_by=(revenue - cost).desc())
+    ).order_by('group' if group_by == 'hour' else '-revenue')
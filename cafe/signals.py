@@ -0,0 +1,45 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from cafe.models import Category, CategoryImage, Product, ProductImage, \
+    ProductIngredient, stock_changed
+from cafe.services import invalidate_menu, update_product_costs
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=CategoryImage)
+@receiver(post_delete, sender=CategoryImage)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_menu_cache(sender, **kwargs):
+    # invalidating before commit would let a request cache the old menu
+    transaction.on_commit(invalidate_menu)
+
+
+def update_costs(**kwargs):
+    # runs after the commit, the changes that caused it are saved already
+    try:
+        update_product_costs(**kwargs)
+    except Exception:
+        logger.exception('Could not update the product costs')
+
+
+@receiver(stock_changed)
+def update_costs_of_stock(sender, ingredient_ids, **kwargs):
+    # receipts and write-offs, and checkouts that use up a lot
+    update_costs(ingredient_ids=ingredient_ids)
+
+
+@receiver(post_save, sender=ProductIngredient)
+@receiver(post_delete, sender=ProductIngredient)
+def update_cost_of_flow_chart(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: update_costs(product_ids=[instance.product_id]))
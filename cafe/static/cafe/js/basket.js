@@ -0,0 +1,327 @@
+// Sends the basket forms to the JSON API and redraws only the basket.
+// Without JavaScript the forms keep posting to the regular views.
+//
+// When the server does not answer, the basket is kept in the browser and
+// checked out orders are queued in localStorage. The queue is synced in
+// batches with a key per order, so a batch that is sent again after a
+// lost response does not count the sales twice. Orders the server rejects
+// are kept in a list of their own until the barista sends or drops them.
+(function () {
+    'use strict';
+
+    var QUEUE_KEY = 'cafe-order-queue';
+    var REJECTED_KEY = 'cafe-rejected-orders';
+    var TIMEOUT = 5000;
+    var SYNC_INTERVAL = 10000;
+
+    var checkoutForm = document.querySelector('form[data-checkout]');
+    var basket = JSON.parse(
+        document.getElementById('basket-data').textContent);
+    // the basket is edited locally until its order is queued
+    var offline = false;
+    var syncing = false;
+
+    function money(value) {
+        return value.toFixed(2);
+    }
+
+    function renderBasket(data) {
+        basket = data;
+        var container = document.getElementById('basket-items');
+        var template = document.getElementById('basket-item-template');
+        var rows = document.createDocumentFragment();
+        basket.items.forEach(function (item) {
+            var row = template.content.cloneNode(true);
+            row.querySelector('[data-field="title"]').textContent = item.title;
+            row.querySelector('[data-field="count"]').textContent = item.count;
+            row.querySelector('[data-field="price"]').textContent =
+                'x ' + money(item.price);
+            row.querySelector('[data-field="cost"]').textContent =
+                money(item.cost);
+            row.querySelectorAll('input[name="product_id"]').forEach(
+                function (input) {
+                    input.value = item.product_id;
+                }
+            );
+            rows.appendChild(row);
+        });
+        container.replaceChildren(rows);
+        document.getElementById('basket-total').textContent =
+            'Итого: ' + money(basket.total_cost) + ' руб';
+        document.getElementById('basket-id').value = basket.id || '';
+    }
+
+    function loadList(key) {
+        try {
+            return JSON.parse(localStorage.getItem(key)) || [];
+        } catch (error) {
+            return [];
+        }
+    }
+
+    function loadQueue() {
+        return loadList(QUEUE_KEY);
+    }
+
+    function saveQueue(queue) {
+        localStorage.setItem(QUEUE_KEY, JSON.stringify(queue));
+        renderQueue(queue);
+    }
+
+    function renderQueue(queue) {
+        var label = document.getElementById('order-queue');
+        label.hidden = !queue.length;
+        label.textContent = 'Не отправлено чеков: ' + queue.length;
+    }
+
+    function loadRejected() {
+        return loadList(REJECTED_KEY);
+    }
+
+    function saveRejected(rejected) {
+        localStorage.setItem(REJECTED_KEY, JSON.stringify(rejected));
+        renderRejected(rejected);
+    }
+
+    function describeOrder(order) {
+        var items = order.items.map(function (item) {
+            return (item.title || '#' + item.product_id) + ' × ' + item.count;
+        });
+        return new Date(order.created_at).toLocaleString() + ': ' +
+            items.join(', ');
+    }
+
+    function renderRejected(rejected) {
+        var container = document.getElementById('rejected-orders');
+        var rows = document.createDocumentFragment();
+        rejected.forEach(function (entry) {
+            var row = document.createElement('li');
+            var errors = Object.keys(entry.errors || {}).reduce(
+                function (messages, field) {
+                    return messages.concat(entry.errors[field]);
+                }, []);
+            row.textContent = describeOrder(entry.order) + ' — ' +
+                errors.join(' ') + ' ';
+            [['retry', 'Отправить снова'], ['drop', 'Удалить']].forEach(
+                function (action) {
+                    var button = document.createElement('button');
+                    button.type = 'button';
+                    button.className = 'btn btn-link btn-sm p-0 mr-2';
+                    button.dataset.action = action[0];
+                    button.dataset.key = entry.order.key;
+                    button.textContent = action[1];
+                    row.appendChild(button);
+                }
+            );
+            rows.appendChild(row);
+        });
+        container.replaceChildren(rows);
+        container.hidden = !rejected.length;
+    }
+
+    function handleRejected(event) {
+        var button = event.target.closest('button[data-action]');
+        if (!button) {
+            return;
+        }
+        var key = button.dataset.key;
+        var rejected = loadRejected();
+        var entry = rejected.find(function (entry) {
+            return entry.order.key === key;
+        });
+        saveRejected(rejected.filter(function (entry) {
+            return entry.order.key !== key;
+        }));
+        if (entry && button.dataset.action === 'retry') {
+            saveQueue(loadQueue().concat(entry.order));
+            sync();
+        }
+    }
+
+    function newKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        var bytes = crypto.getRandomValues(new Uint8Array(16));
+        bytes[6] = (bytes[6] & 0x0f) | 0x40;
+        bytes[8] = (bytes[8] & 0x3f) | 0x80;
+        var hex = Array.prototype.map.call(bytes, function (byte) {
+            return (byte + 0x100).toString(16).slice(1);
+        }).join('');
+        return [hex.slice(0, 8), hex.slice(8, 12), hex.slice(12, 16),
+                hex.slice(16, 20), hex.slice(20)].join('-');
+    }
+
+    function send(url, body, headers) {
+        var controller = new AbortController();
+        var timer = setTimeout(function () {
+            controller.abort();
+        }, TIMEOUT);
+        headers['X-Requested-With'] = 'XMLHttpRequest';
+        return fetch(url, {
+            method: 'POST',
+            body: body,
+            credentials: 'same-origin',
+            headers: headers,
+            signal: controller.signal
+        }).then(function (response) {
+            clearTimeout(timer);
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        }, function (error) {
+            // no answer, unlike an error response the request may be retried
+            clearTimeout(timer);
+            error.offline = true;
+            throw error;
+        });
+    }
+
+    function reloadBasket() {
+        // the server rejected the request, show the basket it has
+        fetch(checkoutForm.dataset.basket, {
+            credentials: 'same-origin',
+            headers: {'X-Requested-With': 'XMLHttpRequest'}
+        }).then(function (response) {
+            return response.ok ? response.json() : null;
+        }).then(function (data) {
+            if (data) {
+                renderBasket(data);
+            }
+        }).catch(function () {});
+    }
+
+    function editLocally(form) {
+        var data = new FormData(form);
+        var productId = Number(data.get('product_id'));
+        var count = Number(data.get('product_count'));
+        var item = basket.items.find(function (item) {
+            return item.product_id === productId;
+        });
+        if (!item) {
+            if (count <= 0 || !form.dataset.title) {
+                return;
+            }
+            item = {
+                product_id: productId,
+                title: form.dataset.title,
+                price: Number(form.dataset.price),
+                count: 0
+            };
+            basket.items.push(item);
+        }
+        item.count += count;
+        item.cost = item.count * item.price;
+        basket.items = basket.items.filter(function (item) {
+            return item.count > 0;
+        });
+        basket.total_cost = basket.items.reduce(function (total, item) {
+            return total + item.cost;
+        }, 0);
+        renderBasket(basket);
+    }
+
+    function queueCheckout(key) {
+        if (basket.items.length) {
+            saveQueue(loadQueue().concat({
+                key: key || newKey(),
+                basket_id: basket.id,
+                created_at: new Date().toISOString(),
+                // the title is only shown if the server rejects the order
+                items: basket.items.map(function (item) {
+                    return {product_id: item.product_id, title: item.title,
+                            count: item.count};
+                })
+            }));
+        }
+        // the next order gets a basket of its own on the server
+        renderBasket({id: null, items: [], total_cost: 0});
+    }
+
+    function handleLocally(form, key) {
+        offline = true;
+        if (form === checkoutForm) {
+            queueCheckout(key);
+        } else {
+            editLocally(form);
+        }
+    }
+
+    function sync() {
+        var queue = loadQueue();
+        if (!queue.length || syncing) {
+            return;
+        }
+        syncing = true;
+        var batch = queue.slice(0, Number(checkoutForm.dataset.batchSize));
+        send(checkoutForm.dataset.sync, JSON.stringify({orders: batch}), {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': checkoutForm.elements.csrfmiddlewaretoken.value
+        }).then(function (data) {
+            var synced = {};
+            var rejected = loadRejected();
+            data.orders.forEach(function (result) {
+                synced[result.key] = result;
+            });
+            var queue = loadQueue().filter(function (order) {
+                var result = synced[order.key];
+                if (result && (result.status === 'invalid' ||
+                               result.status === 'error')) {
+                    rejected.push({order: order, errors: result.errors});
+                }
+                return !result;
+            });
+            saveRejected(rejected);
+            saveQueue(queue);
+            if (offline && !basket.items.length) {
+                offline = false;
+                renderBasket(data.basket);
+            }
+            syncing = false;
+            sync();
+        }, function () {
+            syncing = false;
+        });
+    }
+
+    document.addEventListener('submit', function (event) {
+        var form = event.target;
+        if (!form.dataset.api || !window.fetch || !window.AbortController) {
+            return;
+        }
+        event.preventDefault();
+        if (offline) {
+            handleLocally(form);
+            sync();
+            return;
+        }
+        var data = new FormData(form);
+        // the server may have taken the order even if the answer is lost,
+        // the queued copy is then recognised by the same key
+        var key = newKey();
+        if (form === checkoutForm) {
+            data.append('client_key', key);
+        }
+        send(form.dataset.api, data, {}).then(function (data) {
+            renderBasket(data.basket || data);
+        }).catch(function (error) {
+            if (error.offline) {
+                handleLocally(form, key);
+            } else {
+                // a form post would repeat the request without the key,
+                // the server may have taken the order before it failed
+                console.warn('Request failed', error);
+                reloadBasket();
+            }
+        });
+    });
+
+    renderQueue(loadQueue());
+    renderRejected(loadRejected());
+    document.getElementById('rejected-orders').addEventListener(
+        'click', handleRejected);
+    window.addEventListener('online', sync);
+    setInterval(sync, SYNC_INTERVAL);
+    sync();
+}());
@@ -1,3 +1,1211 @@
-from django.test import TestCase
+import base64
+import json
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO, StringIO
+from tempfile import mkdtemp
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, models, transaction, IntegrityError
+from django.test import RequestFactory, TestCase, TransactionTestCase, \
+    override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from cafe.models import Basket, BasketItem, Category, CategoryImage, \
+    DailySalesRollup, DestructionIngredient, Ingredient, IngredientStock, \
+    Order, OrderTask, Product, ProductImage, ProductIngredient, Shipment, \
+    StockAlert, Thumbnail, Warehouse
+from cafe import services
+from cafe.management.commands.explain_hot_queries import find_seq_scans, \
+    get_hot_queries
+from cafe.services import checkout, edit_basket, get_menu_cache_stats, \
+    get_sales_analytics, open_basket, \
+    process_order_tasks, products_in_category, update_product_costs
+from cafe.views import ReportEditView, WarehouseListView
+from coffee_point.db import check_connections
+
+
+class CafeTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='barista')
+        cls.category = Category.objects.create(title='Кофе', slug='coffee')
+        cls.ingredients = [
+            Ingredient.objects.create(title=f'Ингредиент {i}')
+            for i in range(3)
+        ]
+        cls.products = []
+        for i in range(6):
+            product = Product.objects.create(
+                title=f'Продукт {i}',
+                price=2.5 + i,
+                published=True,
+                category=cls.category
+            )
+            for ingredient in cls.ingredients:
+                ProductIngredient.objects.create(
+                    product=product, ingredient=ingredient, value=0.2)
+            cls.products.append(product)
+
+    def receive(self, ingredient, value, price):
+        return Shipment.objects.create(
+            ingredient=ingredient,
+            value=value,
+            price=price,
+            shelf_life=timezone.now() + timedelta(days=30)
+        )
+
+    def get_stock(self, ingredient):
+        return list(Warehouse.objects.filter(
+            shipment__ingredient=ingredient
+        ).order_by('shipment__date').values_list('value', flat=True))
+
+    def make_basket(self, products, count=1, user=None):
+        # fills the active basket, checkout opens the next one
+        basket = open_basket((user or self.user).id)
+        BasketItem.objects.bulk_create(
+            BasketItem(basket=basket, product=product, count=count)
+            for product in products
+        )
+        return basket
+
+
+class CheckoutTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.restock()
+
+    def restock(self):
+        Shipment.objects.all().delete()
+        for ingredient in self.ingredients:
+            self.receive(ingredient, 1, 10)
+            self.receive(ingredient, 5, 20)
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        # both baskets partially consume one lot and deplete another
+        small = self.make_basket(self.products[:1])
+        BasketItem.objects.create(
+            basket=small, product=self.products[1], count=5)
+        with CaptureQueriesContext(connection) as small_queries:
+            checkout(small)
+        self.restock()
+        large = self.make_basket(self.products)
+        with CaptureQueriesContext(connection) as large_queries:
+            checkout(large)
+        self.assertEqual(
+            len(small_queries.captured_queries),
+            len(large_queries.captured_queries)
+        )
+
+    def test_splits_consumption_across_lots(self):
+        checkout(self.make_basket(self.products[:1], count=6))
+        for ingredient in self.ingredients:
+            self.assertEqual(self.get_stock(ingredient), [4.8])
+        stock = IngredientStock.objects.get(ingredient=self.ingredients[0])
+        self.assertAlmostEqual(stock.weighted_cost, 20)
+
+    def test_order_cost_is_read_from_products(self):
+        update_product_costs()
+        order = checkout(self.make_basket(self.products[:2], count=2))
+        # both products use 0.2 of every ingredient from the 10.0 lots
+        self.assertAlmostEqual(order.cost, 2 * 2 * 3 * 0.2 * 10)
+        self.assertEqual(
+            list(order.lines.values_list('unit_cost', flat=True)), [6, 6])
+
+    def test_shortage_is_taken_out_of_stock(self):
+        checkout(self.make_basket(self.products[:1], count=35))
+        self.assertFalse(Warehouse.objects.exists())
+        for ingredient in self.ingredients:
+            self.assertAlmostEqual(
+                IngredientStock.objects.get(ingredient=ingredient).on_hand, 0)
+
+    @override_settings(CAFE_STOCK_ORDERING='fefo')
+    def test_fefo_consumes_earliest_shelf_life(self):
+        ingredient = self.ingredients[0]
+        soon = self.receive(ingredient, 1, 30)
+        Shipment.objects.filter(id=soon.id).update(
+            shelf_life=timezone.now() + timedelta(days=1))
+        checkout(self.make_basket(self.products[:1], count=5))
+        self.assertEqual(self.get_stock(ingredient), [1, 5])
+
+    def test_basket_is_checked_out_once(self):
+        basket = self.make_basket(self.products[:1], count=5)
+        order = checkout(basket)
+        self.assertIsNone(checkout(basket))
+        self.assertEqual(list(Order.objects.all()), [order])
+        for ingredient in self.ingredients:
+            self.assertEqual(self.get_stock(ingredient), [5])
+
+    def test_opens_new_basket(self):
+        basket = self.make_basket(self.products[:2])
+        checkout(basket)
+        self.assertEqual(Basket.objects.filter(user=self.user).count(), 2)
+        self.assertNotEqual(Basket.objects.latest().id, basket.id)
+        self.assertEqual(
+            Basket.objects.get(status=Basket.Status.ACTIVE).user, self.user)
+
+
+class IngredientStockTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.ingredient = self.ingredients[0]
+        self.receive(self.ingredient, 1, 10)
+        self.receive(self.ingredient, 3, 20)
+
+    def assertStock(self, on_hand, weighted_cost):
+        stock = IngredientStock.objects.get(ingredient=self.ingredient)
+        self.assertAlmostEqual(stock.on_hand, on_hand)
+        self.assertAlmostEqual(stock.weighted_cost, weighted_cost)
+        call_command(
+            'rebuild_ingredient_stock', verify=True, stdout=StringIO())
+
+    def test_shipment_adds_stock(self):
+        self.assertStock(4, 17.5)
+
+    def test_checkout_deducts_stock(self):
+        checkout(self.make_basket(self.products[:1], count=10))
+        self.assertStock(2, 20)
+
+    def test_write_off_deducts_stock(self):
+        warehouse = Warehouse.objects.get(shipment__price=20)
+        DestructionIngredient.objects.create(
+            user=self.user, warehouse=warehouse, value=1)
+        self.assertStock(3, 50 / 3)
+        DestructionIngredient.objects.create(
+            user=self.user, warehouse=warehouse)
+        self.assertStock(1, 10)
+
+    def test_write_off_must_be_positive(self):
+        warehouse = Warehouse.objects.get(shipment__price=20)
+        for value in (0, -2):
+            with self.assertRaises(ValidationError):
+                DestructionIngredient.objects.create(
+                    user=self.user, warehouse=warehouse, value=value)
+        self.assertFalse(DestructionIngredient.objects.exists())
+        self.assertEqual(Warehouse.objects.get(id=warehouse.id).value, 3)
+        self.assertStock(4, 17.5)
+        # the admin shows one message for any value that is not positive
+        for value in (0, -2):
+            with self.assertRaises(ValidationError) as error:
+                DestructionIngredient(
+                    user=self.user, warehouse=warehouse, value=value
+                ).full_clean()
+            self.assertEqual(error.exception.message_dict, {
+                'value': ['Количество должно быть больше нуля']})
+
+    def test_rebuild_fixes_drift(self):
+        IngredientStock.objects.update(on_hand=100)
+        with self.assertRaises(CommandError):
+            call_command(
+                'rebuild_ingredient_stock', verify=True, stdout=StringIO())
+        call_command('rebuild_ingredient_stock', stdout=StringIO())
+        self.assertStock(4, 17.5)
+
+    @mock.patch.object(WarehouseListView, 'paginate_by', 2)
+    def test_warehouse_lists_the_lots_of_one_ingredient(self):
+        self.receive(self.ingredient, 7, 40)
+        for ingredient in self.ingredients[1:]:
+            self.receive(ingredient, 6, 30)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('warehouse'))
+        self.assertNotContains(response, 'Партии')
+
+        url = reverse('warehouse')
+        response = self.client.get(url, {'ingredient': self.ingredient.id})
+        self.assertContains(response, 'Партии: Ингредиент 0')
+        # the earliest lots come first, two to a page
+        self.assertContains(response, '<td>1.00</td>')
+        self.assertContains(response, '<td>3.00</td>')
+        self.assertNotContains(response, '<td>7.00</td>')
+        response = self.client.get(
+            url, {'ingredient': self.ingredient.id, 'page': 2})
+        self.assertContains(response, '<td>7.00</td>')
+        self.assertNotContains(response, '<td>3.00</td>')
+
+
+class ProductCostTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        for ingredient in self.ingredients:
+            self.receive(ingredient, 0.1, 10)
+            self.receive(ingredient, 5, 20)
+
+    def get_cost(self, product):
+        return Product.objects.get(id=product.id).cost
+
+    def test_fifo_prices_the_next_lots(self):
+        update_product_costs()
+        # 0.1 at 10.0 and 0.1 at 20.0 of each of the 3 ingredients
+        self.assertAlmostEqual(self.get_cost(self.products[0]), 3 * 3)
+
+    @override_settings(CAFE_PRODUCT_COST_METHOD='average')
+    def test_average_prices_the_balance(self):
+        update_product_costs()
+        average = (0.1 * 10 + 5 * 20) / 5.1
+        self.assertAlmostEqual(
+            self.get_cost(self.products[0]), round(3 * 0.2 * average, 2))
+
+    def test_shortage_is_priced_by_last_purchase(self):
+        Warehouse.objects.all().delete()
+        update_product_costs()
+        self.assertAlmostEqual(self.get_cost(self.products[0]), 3 * 0.2 * 20)
+
+    def test_only_products_using_the_ingredients_are_updated(self):
+        ProductIngredient.objects.filter(
+            product=self.products[0], ingredient=self.ingredients[0]
+        ).delete()
+        ProductIngredient.objects.exclude(
+            ingredient=self.ingredients[0]).delete()
+        Product.objects.filter(id=self.products[0].id).update(cost=99)
+        with CaptureQueriesContext(connection) as queries:
+            updated = update_product_costs(
+                ingredient_ids=[self.ingredients[0].id])
+        self.assertEqual(updated, 5)
+        self.assertEqual(self.get_cost(self.products[0]), 99)
+        self.assertAlmostEqual(self.get_cost(self.products[1]), 3)
+        # products, flow charts, lots, last prices and the update
+        self.assertEqual(len(queries.captured_queries), 5)
+
+
+class ProductCostUpdateTest(CafeTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+
+    def test_costs_follow_shipments_and_flow_charts(self):
+        product = self.products[0]
+        for ingredient in self.ingredients:
+            self.receive(ingredient, 1, 10)
+        self.assertAlmostEqual(
+            Product.objects.get(id=product.id).cost, 3 * 0.2 * 10)
+        ProductIngredient.objects.filter(product=product).update(value=0.5)
+        ProductIngredient.objects.filter(product=product).first().save()
+        self.assertAlmostEqual(
+            Product.objects.get(id=product.id).cost, 3 * 0.5 * 10)
+
+    def test_costs_follow_checkouts_and_write_offs(self):
+        product = self.products[0]
+        for ingredient in self.ingredients:
+            self.receive(ingredient, 2, 10)
+            self.receive(ingredient, 100, 20)
+            self.receive(ingredient, 100, 30)
+        # the order takes the whole 10.0 lots
+        order = checkout(self.make_basket([product], count=10))
+        self.assertAlmostEqual(order.cost, 10 * 3 * 0.2 * 10)
+        self.assertAlmostEqual(
+            Product.objects.get(id=product.id).cost, 3 * 0.2 * 20)
+        with mock.patch('cafe.signals.update_product_costs') as update:
+            self.assertAlmostEqual(
+                checkout(self.make_basket([product])).cost, 3 * 0.2 * 20)
+        # no lot is used up, so no cost moves
+        update.assert_not_called()
+
+        for lot in Warehouse.objects.filter(shipment__price=20):
+            DestructionIngredient.objects.create(warehouse=lot)
+        self.assertAlmostEqual(
+            Product.objects.get(id=product.id).cost, 3 * 0.2 * 30)
+
+
+class ExpiryTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.ingredient = self.ingredients[0]
+        self.fresh = self.receive(self.ingredient, 1, 10)
+        self.expired = []
+        for price in (20, 30, 40):
+            shipment = self.receive(self.ingredient, 2, price)
+            self.expired.append(shipment)
+        Shipment.objects.filter(
+            id__in=[shipment.id for shipment in self.expired]
+        ).update(shelf_life=timezone.now() - timedelta(days=1))
+
+    def test_checkout_skips_expired_lots(self):
+        update_product_costs()
+        order = checkout(self.make_basket(self.products[:1], count=5))
+        self.assertEqual(self.get_stock(self.ingredient), [2, 2, 2])
+        self.assertAlmostEqual(order.cost, 1 * 10)
+
+    def test_expired_lots_are_written_off_in_batches(self):
+        out = StringIO()
+        call_command('write_off_expired', batch_size=2, stdout=out)
+        self.assertIn('Wrote off 3 expired lots', out.getvalue())
+        self.assertEqual(self.get_stock(self.ingredient), [1, 0, 0, 0])
+        self.assertEqual(
+            sorted(DestructionIngredient.objects.values_list(
+                'warehouse__shipment_id', 'value', 'user')),
+            [(shipment.id, 2, None) for shipment in self.expired]
+        )
+        stock = IngredientStock.objects.get(ingredient=self.ingredient)
+        self.assertAlmostEqual(stock.on_hand, 1)
+        self.assertAlmostEqual(stock.weighted_cost, 10)
+        call_command(
+            'rebuild_ingredient_stock', verify=True, stdout=StringIO())
+        call_command('write_off_expired', stdout=out)
+        self.assertIn('Wrote off 0 expired lots', out.getvalue())
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.received.append(json.loads(self.rfile.read(length)))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(
+    CAFE_STOCK_ALERT_BACKENDS=['cafe.alerts.EmailBackend'],
+    CAFE_STOCK_ALERT_EMAILS=['manager@example.com']
+)
+class StockAlertTest(CafeTestMixin, TransactionTestCase):
+    # on_commit callbacks only run outside of TestCase transactions
+    def setUp(self):
+        self.setUpTestData()
+        self.ingredient = self.ingredients[0]
+        self.ingredient.notify_min_balance = 3
+        self.ingredient.save()
+        self.receive(self.ingredient, 4, 10)
+
+    def consume(self, value):
+        # every product uses 0.2 of each ingredient
+        checkout(self.make_basket(self.products[:1], count=int(value * 5)))
+
+    def test_alert_is_sent_once_until_restocked(self):
+        self.consume(2)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Ингредиент 0: остаток 2.00', mail.outbox[0].body)
+        self.consume(1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        self.receive(self.ingredient, 5, 10)
+        self.assertIsNotNone(StockAlert.objects.get().resolved_at)
+        self.consume(4)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            StockAlert.objects.filter(resolved_at__isnull=True).count(), 1)
+
+    @override_settings(CAFE_STOCK_ALERT_INTERVAL=0)
+    def test_alert_is_repeated_after_the_interval(self):
+        self.consume(2)
+        self.consume(1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(StockAlert.objects.count(), 1)
+
+    def test_only_changed_ingredients_are_checked(self):
+        self.receive(self.ingredients[1], 1, 10)
+        # raising a threshold does not change the stock
+        Ingredient.objects.filter(id=self.ingredients[1].id).update(
+            notify_min_balance=2)
+        warehouse = Warehouse.objects.get(
+            shipment__ingredient=self.ingredient)
+        DestructionIngredient.objects.create(
+            user=self.user, warehouse=warehouse, value=2)
+        self.assertEqual(
+            list(StockAlert.objects.values_list('ingredient', flat=True)),
+            [self.ingredient.id]
+        )
+
+    def test_webhook_backend_posts_alerts(self):
+        server = HTTPServer(('127.0.0.1', 0), WebhookHandler)
+        threading.Thread(target=server.handle_request, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/alerts'
+        with override_settings(
+                CAFE_STOCK_ALERT_BACKENDS=['cafe.alerts.WebhookBackend'],
+                CAFE_STOCK_ALERT_WEBHOOK_URL=url):
+            self.consume(2)
+        server.server_close()
+        alerts = WebhookHandler.received.pop()['alerts']
+        self.assertEqual(
+            [(alert['ingredient_id'], alert['on_hand']) for alert in alerts],
+            [(self.ingredient.id, 2)]
+        )
+
+    def test_dashboard_lists_low_ingredients(self):
+        self.consume(2)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('stock-alerts'))
+        self.assertContains(response, 'Ниже минимального остатка: 1')
+        self.assertContains(response, 'Ингредиент 0')
+
+
+class ShipmentIntakeTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def make_invoice(self, rows, delimiter=';'):
+        lines = [delimiter.join(('ingredient', 'value', 'price',
+                                 'shelf_life'))]
+        lines += [delimiter.join(map(str, row)) for row in rows]
+        return SimpleUploadedFile(
+            'invoice.csv', '\n'.join(lines).encode('utf-8-sig'))
+
+    def import_invoice(self, rows):
+        return self.client.post(
+            reverse('shipment-import'), {'invoice': self.make_invoice(rows)})
+
+    def test_editing_a_shipment_does_not_add_a_lot(self):
+        shipment = self.receive(self.ingredients[0], 2, 10)
+        shipment.price = 12
+        shipment.save()
+        self.assertEqual(self.get_stock(self.ingredients[0]), [2])
+        self.assertEqual(
+            Warehouse.objects.get().shipment_id, shipment.id)
+
+    def test_invoice_creates_shipments_lots_and_stock(self):
+        response = self.import_invoice([
+            ('Ингредиент 0', '2,5', 10, '31.12.2030'),
+            ('Ингредиент 0', 1.5, 30, '2030-12-31'),
+            ('Ингредиент 1', 4, 5, '2030-12-31'),
+        ])
+        self.assertRedirects(response, reverse('warehouse'))
+        self.assertEqual(self.get_stock(self.ingredients[0]), [2.5, 1.5])
+        stock = IngredientStock.objects.get(ingredient=self.ingredients[0])
+        self.assertAlmostEqual(stock.on_hand, 4)
+        self.assertAlmostEqual(stock.weighted_cost, 17.5)
+        self.assertEqual(
+            {lot.shipment.ingredient_id for lot in Warehouse.objects.all()},
+            {self.ingredients[0].id, self.ingredients[1].id}
+        )
+        self.assertEqual(
+            timezone.localdate(Shipment.objects.first().shelf_life),
+            date(2030, 12, 31)
+        )
+
+    def test_invalid_rows_are_reported(self):
+        response = self.import_invoice([
+            ('Ингредиент 0', 1, 10, '2030-12-31'),
+            ('Сахар', 1, 10, '2030-12-31'),
+            ('Ингредиент 1', 'много', 10, '2030-12-31'),
+        ])
+        self.assertContains(response, 'Строка 3: Неизвестный ингредиент')
+        self.assertContains(response, 'Строка 4:')
+        self.assertNotContains(response, 'Строка 2:')
+        self.assertFalse(Shipment.objects.exists())
+
+    def test_query_count_does_not_depend_on_invoice_size(self):
+        counts = []
+        for size in (1, 30):
+            rows = [(ingredient.title, 1, 10, '2030-12-31')
+                    for ingredient in self.ingredients] * size
+            with CaptureQueriesContext(connection) as queries:
+                self.import_invoice(rows)
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Warehouse.objects.count(), 31 * 3)
+
+    def test_admin_action_receives_shipments_again(self):
+        shipments = [self.receive(ingredient, 2, 10)
+                     for ingredient in self.ingredients]
+        self.client.post(reverse('admin:cafe_shipment_changelist'), {
+            'action': 'receive_again',
+            '_selected_action': [shipment.id for shipment in shipments],
+        })
+        self.assertEqual(Shipment.objects.count(), 6)
+        for ingredient in self.ingredients:
+            self.assertEqual(self.get_stock(ingredient), [2, 2])
+
+
+class BasketApiTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post_item(self, product, count):
+        return self.client.post(reverse('api-basket-items'), {
+            'product_id': product.id, 'product_count': count})
+
+    def test_edit_returns_basket_state(self):
+        self.post_item(self.products[0], 1)
+        self.post_item(self.products[0], 1)
+        data = self.post_item(self.products[1], 1).json()
+        self.assertEqual(
+            [(item['product_id'], item['count']) for item in data['items']],
+            [(self.products[0].id, 2), (self.products[1].id, 1)]
+        )
+        self.assertEqual(data['total_cost'], 2 * 2.5 + 3.5)
+
+        data = self.post_item(self.products[1], -1).json()
+        self.assertEqual(len(data['items']), 1)
+        self.assertEqual(self.client.get(reverse('api-basket')).json(), data)
+
+    def test_counts_are_added_and_removed(self):
+        self.post_item(self.products[0], 3)
+        self.post_item(self.products[0], 2)
+        self.assertEqual(self.post_item(self.products[0], -4).json()[
+            'items'][0]['count'], 1)
+        self.assertEqual(
+            self.post_item(self.products[0], -2).json()['items'], [])
+        self.assertEqual(
+            self.post_item(self.products[1], -1).json()['items'], [])
+
+    def test_counts_are_bounded(self):
+        self.assertEqual(self.post_item(self.products[0], 40000).status_code,
+                         400)
+        self.post_item(self.products[0], BasketItem.MAX_COUNT)
+        data = self.post_item(self.products[0], BasketItem.MAX_COUNT).json()
+        self.assertEqual(data['items'][0]['count'], BasketItem.MAX_COUNT)
+
+    def test_active_basket_is_found_by_primary_key(self):
+        for _ in range(3):
+            self.post_item(self.products[0], 1)
+            basket_id = self.post_item(self.products[0], 1).json()['id']
+            self.client.post(
+                reverse('api-checkout'), {'basket_id': basket_id})
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('api-basket')).json()
+        basket_queries = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "cafe_basket"')
+        ]
+        self.assertEqual(len(basket_queries), 1)
+        self.assertIn('"cafe_basket"."id" =', basket_queries[0])
+        self.assertEqual(data['items'], [])
+        self.assertEqual(Basket.objects.filter(
+            user=self.user, status=Basket.Status.ORDERED).count(), 3)
+
+    def test_invalid_product_is_rejected(self):
+        response = self.client.post(reverse('api-basket-items'), {
+            'product_id': 0, 'product_count': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.json()['errors'])
+
+    def test_checkout_returns_new_basket(self):
+        basket_id = self.post_item(self.products[0], 1).json()['id']
+        response = self.client.post(
+            reverse('api-checkout'), {'basket_id': basket_id})
+        data = response.json()
+        self.assertEqual(data['order']['price'], 2.5)
+        self.assertNotEqual(data['basket']['id'], basket_id)
+        self.assertEqual(data['basket']['items'], [])
+
+    def test_checkout_of_another_users_basket_is_rejected(self):
+        other = User.objects.create(username='other')
+        basket = Basket.objects.create(user=other)
+        response = self.client.post(
+            reverse('api-checkout'), {'basket_id': basket.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_repeated_checkout_is_rejected(self):
+        basket_id = self.post_item(self.products[0], 1).json()['id']
+        self.client.post(reverse('api-checkout'), {'basket_id': basket_id})
+        response = self.client.post(
+            reverse('api-checkout'), {'basket_id': basket_id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retried_checkout_returns_the_same_order(self):
+        key = str(uuid.uuid4())
+        first = self.post_item(self.products[0], 1).json()['id']
+        order = self.client.post(reverse('api-checkout'), {
+            'basket_id': first, 'client_key': key}).json()['order']
+        # the retry may carry the basket the terminal had or the next one
+        second = self.post_item(self.products[1], 1).json()['id']
+        for basket_id in (first, second):
+            response = self.client.post(reverse('api-checkout'), {
+                'basket_id': basket_id, 'client_key': key})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['order'], order)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Basket.objects.get(id=second).status,
+                         Basket.Status.ACTIVE)
+
+    def test_order_view_ignores_another_users_basket(self):
+        other = User.objects.create(username='other')
+        basket = self.make_basket(self.products[:1], user=other)
+        self.client.post(reverse('order'), {'basket_id': basket.id})
+        self.assertFalse(Order.objects.exists())
+        self.client.post(reverse('order'), {
+            'basket_id': self.post_item(self.products[0], 1).json()['id']})
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class OrderSyncApiTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+        for ingredient in self.ingredients:
+            self.receive(ingredient, 10, 10)
+
+    def make_order(self, products, **kwargs):
+        return {
+            'key': str(uuid.uuid4()),
+            'items': [{'product_id': product.id, 'count': 1}
+                      for product in products],
+            **kwargs
+        }
+
+    def sync(self, orders):
+        return self.client.post(
+            reverse('api-orders-sync'), json.dumps({'orders': orders}),
+            content_type='application/json'
+        ).json()['orders']
+
+    def test_replayed_batch_is_not_counted_twice(self):
+        orders = [self.make_order(self.products[:2]),
+                  self.make_order(self.products[2:3])]
+        results = self.sync(orders)
+        self.assertEqual(
+            [result['status'] for result in results], ['created'] * 2)
+        self.assertEqual(self.sync(orders), [
+            {'key': result['key'], 'status': 'duplicate', 'id': result['id']}
+            for result in results
+        ])
+        self.assertEqual(Order.objects.count(), 2)
+        process_order_tasks(10)
+        self.assertAlmostEqual(
+            DailySalesRollup.objects.get().revenue, 2.5 + 3.5 + 4.5)
+        for ingredient in self.ingredients:
+            self.assertAlmostEqual(sum(self.get_stock(ingredient)), 9.4)
+
+    def test_queued_checkout_of_the_active_basket(self):
+        basket = Basket.objects.create(user=self.user)
+        BasketItem.objects.create(basket=basket, product=self.products[0])
+        order = self.make_order(self.products[1:2], basket_id=basket.id)
+        self.assertEqual(self.sync([order])[0]['status'], 'created')
+        basket.refresh_from_db()
+        self.assertEqual(basket.status, Basket.Status.ORDERED)
+        self.assertEqual(
+            list(basket.items.values_list('product', flat=True)),
+            [self.products[1].id]
+        )
+        self.assertTrue(Basket.objects.filter(
+            user=self.user, status=Basket.Status.ACTIVE).exists())
+
+    def test_offline_time_is_kept(self):
+        created_at = timezone.now() - timedelta(days=1)
+        self.sync([self.make_order(
+            self.products[:1], created_at=created_at.isoformat())])
+        self.assertEqual(Order.objects.get().created_at, created_at)
+        process_order_tasks(10)
+        self.assertEqual(
+            DailySalesRollup.objects.get().date,
+            timezone.localdate(created_at)
+        )
+
+    def test_invalid_orders_do_not_block_the_batch(self):
+        too_many = self.make_order(self.products[:1])
+        too_many['items'][0]['count'] = BasketItem.MAX_COUNT + 1
+        results = self.sync([
+            {'key': 'not a key', 'items': []},
+            self.make_order([Product(id=0)]),
+            too_many,
+            self.make_order(self.products[:1]),
+        ])
+        self.assertEqual([result['status'] for result in results],
+                         ['invalid', 'invalid', 'invalid', 'created'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_checkout_with_key_is_recognised_when_synced(self):
+        basket = Basket.objects.create(user=self.user)
+        BasketItem.objects.create(basket=basket, product=self.products[0])
+        key = str(uuid.uuid4())
+        # the answer to the checkout was lost and the order was queued
+        self.client.post(reverse('api-checkout'),
+                         {'basket_id': basket.id, 'client_key': key})
+        order = self.make_order(self.products[:1], basket_id=basket.id)
+        order['key'] = key
+        self.assertEqual(self.sync([order])[0]['status'], 'duplicate')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_conflict_without_the_order_is_an_error(self):
+        # e.g. another request opened the active basket at the same time
+        with mock.patch('cafe.services.take_offline_basket',
+                        side_effect=IntegrityError):
+            result = self.sync([self.make_order(self.products[:1])])[0]
+        self.assertEqual(result['status'], 'error')
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderWorkerTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        for ingredient in self.ingredients:
+            self.receive(ingredient, 1, 10)
+            self.receive(ingredient, 5, 20)
+
+    def run_worker(self):
+        out = StringIO()
+        call_command('run_cafe_worker', once=True, stdout=out)
+        return out.getvalue()
+
+    def test_checkout_leaves_only_the_stock(self):
+        order = checkout(
+            self.make_basket(self.products[:1], count=2), in_background=True)
+        self.assertEqual(order.price, 5)
+        self.assertTrue(OrderTask.objects.filter(order=order).exists())
+        self.assertEqual(self.get_stock(self.ingredients[0]), [1, 5])
+        # the report does not wait for the worker
+        self.assertEqual(DailySalesRollup.objects.get().revenue, 5)
+
+        self.assertEqual(self.run_worker(), 'Processed 1 orders\n')
+        self.assertFalse(OrderTask.objects.exists())
+        for ingredient in self.ingredients:
+            self.assertEqual(self.get_stock(ingredient), [0.6, 5])
+        self.assertEqual(DailySalesRollup.objects.get().revenue, 5)
+
+    def test_orders_are_processed_in_one_batch(self):
+        for _ in range(3):
+            checkout(self.make_basket(self.products[:1]), in_background=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(process_order_tasks(10), 3)
+        # the same queries fulfil one order
+        checkout(self.make_basket(self.products[:1]), in_background=True)
+        with CaptureQueriesContext(connection) as single_queries:
+            process_order_tasks(10)
+        self.assertEqual(len(queries), len(single_queries))
+        self.assertAlmostEqual(self.get_stock(self.ingredients[0])[0], 0.2)
+        rollup = DailySalesRollup.objects.get()
+        self.assertEqual(rollup.order_count, 4)
+        self.assertEqual(rollup.revenue, 10)
+
+    def test_failed_order_is_retried_without_blocking_others(self):
+        broken = checkout(
+            self.make_basket(self.products[:1]), in_background=True)
+        checkout(self.make_basket(self.products[1:2]), in_background=True)
+        fulfil_orders = services.fulfil_orders
+
+        def fail_broken(lines):
+            lines = list(lines)
+            if (self.products[0].id, 1) in lines:
+                raise ValueError('Broken order')
+            return fulfil_orders(lines)
+
+        with mock.patch('cafe.services.fulfil_orders', fail_broken), \
+                self.assertLogs('cafe.services', 'ERROR'):
+            self.assertEqual(process_order_tasks(10), 2)
+        task = OrderTask.objects.get()
+        self.assertEqual(task.order, broken)
+        self.assertEqual(task.attempts, 1)
+        self.assertIn('Broken order', task.last_error)
+        self.assertGreater(task.run_after, timezone.now())
+        self.assertEqual(self.get_stock(self.ingredients[0]), [0.8, 5])
+        # the failed order is still in the report
+        self.assertEqual(DailySalesRollup.objects.get().revenue, 2.5 + 3.5)
+        # it waits for the retry delay
+        self.assertEqual(process_order_tasks(10), 0)
+
+        OrderTask.objects.update(run_after=timezone.now())
+        self.assertEqual(process_order_tasks(10), 1)
+        self.assertFalse(OrderTask.objects.exists())
+        self.assertAlmostEqual(self.get_stock(self.ingredients[0])[0], 0.6)
+        self.assertEqual(DailySalesRollup.objects.get().revenue, 2.5 + 3.5)
+
+
+class MenuCacheTest(CafeTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_menu_is_served_from_cache(self):
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('home'))
+        tables = ('FROM "cafe_category"', 'FROM "cafe_product"')
+        self.assertFalse(any(
+            table in query['sql']
+            for query in queries.captured_queries for table in tables
+        ))
+        self.assertEqual(get_menu_cache_stats()['misses'], 2)
+
+    def test_changes_invalidate_menu(self):
+        request = RequestFactory().get(reverse('home'))
+        self.assertEqual(len(products_in_category(request)), 6)
+        version = get_menu_cache_stats()['version']
+        Product.objects.create(
+            title='Новинка', price=1, published=True, category=self.category)
+        self.assertEqual(len(products_in_category(request)), 7)
+        self.assertGreater(get_menu_cache_stats()['version'], version)
+
+    def test_change_in_another_process_reaches_this_one(self):
+        request = RequestFactory().get(reverse('home'))
+        self.assertEqual(len(products_in_category(request)), 6)
+        # each gunicorn worker has its own local memory cache
+        with mock.patch.object(services, 'cache', LocMemCache('other', {})):
+            Product.objects.create(title='Новинка', price=1, published=True,
+                                   category=self.category)
+        self.assertEqual(len(products_in_category(request)), 7)
+
+    def add_menu_items(self, count):
+        category = Category.objects.create(
+            title=f'Категория {count}', slug=f'category-{count}')
+        Product.objects.bulk_create(
+            Product(title=f'Продукт {count}-{i}', price=1, published=True,
+                    category=self.category)
+            for i in range(count)
+        )
+        products = Product.objects.filter(
+            title__startswith=f'Продукт {count}-')
+        CategoryImage.objects.bulk_create([CategoryImage(
+            description='', image='c.jpg', thumbnail_jpeg='c.jpg',
+            thumbnail_webp='c.webp', category=category
+        )])
+        ProductImage.objects.bulk_create(
+            ProductImage(description='', image='p.jpg',
+                         thumbnail_jpeg='p.jpg', thumbnail_webp='p.webp',
+                         product=product)
+            for product in products
+        )
+        basket = Basket.objects.filter(user=self.user).latest()
+        BasketItem.objects.bulk_create(
+            BasketItem(basket=basket, product=product, count=1)
+            for product in products
+        )
+
+    def count_home_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_home_page_query_count_does_not_grow_with_menu(self):
+        self.client.get(reverse('home'))
+        self.add_menu_items(2)
+        expected = self.count_home_queries()
+        self.add_menu_items(10)
+        self.assertEqual(self.count_home_queries(), expected)
+
+
+@override_settings(MEDIA_ROOT=mkdtemp())
+class ThumbnailTest(CafeTestMixin, TestCase):
+    def make_jpeg(self, size=(800, 600)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'brown').save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def test_upload_creates_thumbnails(self):
+        content = self.make_jpeg()
+        image = ProductImage.objects.create(
+            description='',
+            image=SimpleUploadedFile('latte.jpg', content),
+            product=self.products[0]
+        )
+        self.assertEqual(
+            base64.b64decode(image.image_base64.partition('base64,')[2]),
+            content
+        )
+        self.assertRegex(image.image_url, r'^/thumbnails/\w+\.jpg$')
+        self.assertRegex(image.webp_url, r'^/thumbnails/\w+\.webp$')
+
+        response = self.client.get(image.webp_url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(BytesIO(response.content)) as webp:
+            self.assertEqual(webp.size, ProductImage.THUMBNAIL_SIZE)
+
+    def test_converts_base64_images(self):
+        content = self.make_jpeg()
+        image_base64 = 'data:jpeg;base64,' + base64.b64encode(
+            content).decode()
+        image = CategoryImage(
+            description='',
+            category=self.category,
+            image='categories/lost.jpg',
+            image_base64=image_base64
+        )
+        models.Model.save(image)
+        # the file is gone with the dyno, the inline copy is shown
+        self.assertEqual(image.image_url, image_base64)
+        self.assertIsNone(image.webp_url)
+
+        call_command('convert_base64_images', stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual(image.image_base64, image_base64)
+        self.assertRegex(image.image_url, r'^/thumbnails/\w+\.jpg$')
+        self.assertTrue(
+            Thumbnail.objects.filter(name=image.thumbnail_webp).exists())
+
+
+class ReportTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+        for days, price in ((1, 10), (1, 5), (0, 7)):
+            order = Order.objects.create(
+                basket=self.make_basket([]), price=price, cost=price / 2)
+            Order.objects.filter(id=order.id).update(
+                created_at=timezone.now() - timedelta(days=days))
+        call_command('backfill_sales_rollup', stdout=StringIO())
+
+    def get_report(self, from_date, to_date):
+        view = ReportEditView()
+        view.setup(RequestFactory().get(reverse('report'), {
+            'from_date': str(from_date),
+            'to_date': str(to_date)
+        }))
+        return view.get_context_data()['orders']
+
+    def test_reads_closed_days_from_rollup(self):
+        DailySalesRollup.objects.filter(date=self.yesterday).update(
+            revenue=100)
+        orders = self.get_report(self.yesterday, self.yesterday)
+        self.assertEqual(orders[str(self.yesterday)]['revenue'], 100)
+        self.assertEqual(orders[str(self.yesterday)]['count_orders'], 2)
+
+    def test_aggregates_today_live(self):
+        DailySalesRollup.objects.all().delete()
+        orders = self.get_report(self.yesterday, self.today)
+        self.assertNotIn(str(self.yesterday), orders)
+        self.assertEqual(orders[str(self.today)]['revenue'], 7)
+        self.assertEqual(orders['total']['count_orders'], 1)
+
+    def test_checkout_updates_rollup(self):
+        basket = self.make_basket(self.products[:2], count=2)
+        with CaptureQueriesContext(connection) as queries:
+            checkout(basket)
+        writes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        # the row every checkout of the day shares is locked last
+        self.assertIn('"cafe_dailysalesrollup"', writes[-1])
+        rollup = DailySalesRollup.objects.get(date=self.today)
+        self.assertEqual(rollup.order_count, 2)
+        self.assertAlmostEqual(rollup.revenue, 7 + 2 * 2.5 + 2 * 3.5)
+
+
+class SalesAnalyticsTest(CafeTestMixin, TestCase):
+    def test_ranks_products_by_revenue(self):
+        checkout(self.make_basket(self.products[:3], count=1))
+        checkout(self.make_basket(self.products[:1], count=3))
+        today = timezone.localdate()
+        rows = list(get_sales_analytics(today, today, 'product'))
+        self.assertEqual(
+            [(row['group'], row['quantity'], row['revenue_rank'])
+             for row in rows],
+            [('Продукт 0', 4, 1), ('Продукт 2', 1, 2), ('Продукт 1', 1, 3)]
+        )
+        by_category = get_sales_analytics(today, today, 'category').get()
+        self.assertEqual(by_category['revenue'], 4 * 2.5 + 3.5 + 4.5)
+
+
+class ReportExportTest(CafeTestMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+        checkout(self.make_basket(self.products[:2], count=2))
+
+    def export(self, **params):
+        today = str(timezone.localdate())
+        response = self.client.get(reverse('report-export'), {
+            'from_date': today, 'to_date': today, **params})
+        return b''.join(response.streaming_content)
+
+    def test_csv_by_day_includes_products(self):
+        rows = self.export(granularity='day', format='csv').decode(
+            'utf-8-sig').splitlines()
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(rows[1].endswith(';Итого;;12.0;0.0;1'))
+        self.assertTrue(rows[2].endswith(';Продукт 0;2;5.0;0.0;'))
+
+    def test_xlsx_by_order_is_a_workbook(self):
+        content = self.export(granularity='order', format='xlsx')
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 4)
+        self.assertIn('Продукт 1', sheet)
+
+
+class SeedCafeTest(TestCase):
+    def seed(self, prefix, seed=0):
+        call_command(
+            'seed_cafe', categories=2, products=8, ingredients=5, lots=10,
+            baristas=2, days=3, orders_per_day=4, seed=seed, prefix=prefix,
+            stdout=StringIO())
+        return list(Order.objects.filter(
+            basket__user__username__startswith=prefix
+        ).order_by('id').values_list('price', 'cost'))
+
+    def test_generates_the_history(self):
+        orders = self.seed('a')
+        self.assertEqual(len(orders), 12)
+        self.assertEqual(Product.objects.filter(published=True).count(), 8)
+        self.assertEqual(Warehouse.objects.count(), 10)
+        self.assertAlmostEqual(
+            sum(price for price, _ in orders),
+            sum(DailySalesRollup.objects.values_list('revenue', flat=True))
+        )
+        call_command(
+            'rebuild_ingredient_stock', verify=True, stdout=StringIO())
+
+    def test_same_seed_generates_same_data(self):
+        self.assertEqual(self.seed('a'), self.seed('b'))
+        self.assertNotEqual(self.seed('c', seed=1), self.seed('d'))
+
+    def test_existing_prefix_is_rejected(self):
+        self.seed('a')
+        with self.assertRaises(CommandError):
+            self.seed('a')
+
+
+class BenchmarkCafeTest(TestCase):
+    def test_reports_every_scenario_and_rolls_back(self):
+        out = StringIO()
+        call_command(
+            'benchmark_cafe', products=12, ingredients=6, lots=20, days=3,
+            orders_per_day=5, items=3, repeat=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            [line.split('  ')[0] for line in lines[2:]],
+            ['home', 'basket edit', 'checkout 3 items', 'queued checkout',
+             'report 30 days', 'report 365 days', 'warehouse',
+             'warehouse lots']
+        )
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+class ExplainHotQueriesTest(CafeTestMixin, TestCase):
+    def test_every_query_is_explained(self):
+        out = StringIO()
+        call_command('explain_hot_queries', stdout=out)
+        for name in get_hot_queries():
+            self.assertIn(f'{name}\n', out.getvalue())
+
+    def test_sequential_scans_are_found(self):
+        self.assertEqual(find_seq_scans(
+            'Sort\n  ->  Seq Scan on cafe_order  (cost=0.00..1.01 rows=1)\n'
+            '  ->  Index Scan using cafe_basket_pkey on cafe_basket'
+        ), ['cafe_order'])
+        self.assertEqual(find_seq_scans(
+            '2 0 0 SCAN cafe_order\n'
+            '4 0 0 SCAN TABLE cafe_basket\n'
+            '6 0 0 SCAN cafe_product USING INDEX cafe_product_menu\n'
+            '8 0 0 SCAN (subquery-2)'
+        ), ['cafe_order', 'cafe_basket'])
+
+
+class BenchmarkConnectionsTest(CafeTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+        self.user.is_staff = True
+        self.user.save()
+
+    def test_reports_every_page_for_both_ages(self):
+        out = StringIO()
+        call_command('benchmark_connections', repeat=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            [line.split()[:2] for line in lines[1:]],
+            [[page, max_age] for max_age in ('0', '60')
+             for page in ('home', 'api-basket', 'warehouse', 'report')]
+        )
+        self.assertFalse(Session.objects.exists())
+
+
+class ConnectionHealthCheckTest(TestCase):
+    def make_connection(self, usable, health_checks=True):
+        conn = mock.Mock(
+            connection=object(),
+            settings_dict={'CONN_HEALTH_CHECKS': health_checks},
+            in_atomic_block=False
+        )
+        conn.is_usable.return_value = usable
+        return conn
+
+    def test_broken_connections_are_closed(self):
+        broken = self.make_connection(usable=False)
+        alive = self.make_connection(usable=True)
+        unchecked = self.make_connection(usable=False, health_checks=False)
+        with mock.patch('coffee_point.db.connections') as connections:
+            connections.all.return_value = [broken, alive, unchecked]
+            check_connections()
+        broken.close.assert_called_once_with()
+        alive.close.assert_not_called()
+        unchecked.is_usable.assert_not_called()
+        unchecked.close.assert_not_called()
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'SQLite serializes the writers')
+class ConcurrentBasketEditTest(CafeTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+        self.basket = Basket.objects.create(user=self.user)
+
+    def edit_in_thread(self, product_count):
+        try:
+            edit_basket(self.basket, self.products[0].id, product_count)
+        finally:
+            connection.close()
+
+    def test_parallel_edits_are_not_lost(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self.edit_in_thread, [1] * 40 + [3] * 20))
+            # decrements race with each other and with the deletes
+            list(executor.map(self.edit_in_thread, [-1] * 30 + [-5] * 8))
+        self.assertEqual(
+            list(self.basket.items.values_list('count', flat=True)), [30])
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class ConcurrentCheckoutTest(CafeTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+        for ingredient in self.ingredients:
+            for _ in range(4):
+                self.receive(ingredient, 2, 10)
+
+    def checkout_in_thread(self, basket):
+        try:
+            return checkout(basket)
+        finally:
+            connection.close()
+
+    def test_parallel_checkouts_do_not_double_spend(self):
+        baskets = [
+            self.make_basket(self.products, user=User.objects.create(
+                username=f'barista {i}'))
+            for i in range(6)
+        ]
+        with ThreadPoolExecutor(max_workers=len(baskets)) as executor:
+            orders = list(executor.map(self.checkout_in_thread, baskets))
+
+        # each basket takes 6 * 0.2 of every ingredient out of 8 on hand
+        for ingredient in self.ingredients:
+            self.assertAlmostEqual(sum(self.get_stock(ingredient)), 0.8)
+        self.assertAlmostEqual(
+            sum(order.cost for order in orders), 6 * 3 * 1.2 * 10)
+
+    def test_checkout_takes_the_next_free_lot(self):
+        ingredient = self.ingredients[0]
+        head = Warehouse.objects.filter(
+            shipment__ingredient=ingredient
+        ).order_by('shipment__date', 'id').first()
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_head_lot():
+            try:
+                with transaction.atomic():
+                    Warehouse.objects.select_for_update().get(id=head.id)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            holder = executor.submit(hold_head_lot)
+            locked.wait(10)
+            try:
+                # waiting for the held lot would take the whole timeout
+                checkout(self.make_basket(self.products[:1]))
+            finally:
+                release.set()
+            holder.result()
+        self.assertEqual(self.get_stock(ingredient), [2, 1.8, 2, 2])
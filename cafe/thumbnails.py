@@ -0,0 +1,32 @@
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Pillow format, file extension and content type of every variant
+THUMBNAIL_FORMATS = (
+    ('JPEG', 'jpg', 'image/jpeg'),
+    ('WEBP', 'webp', 'image/webp'),
+)
+
+
+def make_thumbnails(image_file, size):
+    """Renders the image cropped to ``size`` in every thumbnail format.
+
+    Names are a hash of the content, so a thumbnail never changes once
+    written and can be cached by browsers forever. Returns
+    (name, content type, content) by extension.
+    """
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        thumbnail = ImageOps.fit(image, size, Image.LANCZOS)
+
+    thumbnails = {}
+    for image_format, extension, content_type in THUMBNAIL_FORMATS:
+        buffer = BytesIO()
+        thumbnail.save(buffer, image_format, quality=85)
+        content = buffer.getvalue()
+        digest = hashlib.sha1(content).hexdigest()[:20]
+        name = f'{digest}.{extension}'
+        thumbnails[extension] = (name, content_type, content)
+    return thumbnails
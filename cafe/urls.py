@@ -3,14 +3,33 @@ from django.urls import path
 from django.conf import settings
 
 from cafe.views import HomePageView, BasketEditView, OrderView, ReportEditView, \
-    WarehouseListView
+    WarehouseListView, ReportExportView, AnalyticsView, MenuCacheStatsView, \
+    ThumbnailView, BasketApiView, BasketItemApiView, CheckoutApiView, \
+    ShipmentImportView, StockAlertListView, OrderSyncApiView
 
 urlpatterns = [
     path('', HomePageView.as_view(), name='home'),
     path('basket-edit', BasketEditView.as_view(), name='basket-edit'),
     path('order', OrderView.as_view(), name='order'),
+    path('api/basket', BasketApiView.as_view(), name='api-basket'),
+    path('api/basket/items', BasketItemApiView.as_view(),
+         name='api-basket-items'),
+    path('api/basket/checkout', CheckoutApiView.as_view(),
+         name='api-checkout'),
+    path('api/orders/sync', OrderSyncApiView.as_view(),
+         name='api-orders-sync'),
+    path('menu/cache-stats', MenuCacheStatsView.as_view(),
+         name='menu-cache-stats'),
     path('report', ReportEditView.as_view(), name='report'),
+    path('report/export', ReportExportView.as_view(), name='report-export'),
+    path('analytics', AnalyticsView.as_view(), name='analytics'),
     path('warehouse', WarehouseListView.as_view(), name='warehouse'),
+    path('warehouse/import', ShipmentImportView.as_view(),
+         name='shipment-import'),
+    path('warehouse/alerts', StockAlertListView.as_view(),
+         name='stock-alerts'),
+    path('thumbnails/<str:name>', ThumbnailView.as_view(),
+         name='thumbnail'),
 ]
 
 if settings.DEBUG:
@@ -1,18 +1,32 @@
-from datetime import datetime, date
+import json
+from datetime import datetime
 from contextlib import suppress
 
-from django.utils.timezone import pytz
 from django.conf import settings
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, \
+    PermissionRequiredMixin
+from django.db import IntegrityError
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseBadRequest, \
+    JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.utils import timezone
-from django.views.generic import ListView, TemplateView, FormView
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.generic import ListView, TemplateView, FormView, View
 
-from cafe.forms import BasketEditForm, OrderForm, ReportEditForm
-from cafe.models import Product, Basket, BasketItem, Shipment, Order, Warehouse
-from cafe.services import get_basket_items_latest, isbasket_or_create, \
-    get_total_cost_basket, get_categories_pr_images, get_category_request, \
-    products_in_category
+from cafe.export import XLSX_CONTENT_TYPE, get_day_rows, get_order_rows, \
+    stream_csv, stream_xlsx
+from cafe.forms import BasketEditForm, OrderForm, ReportEditForm, \
+    AnalyticsForm, ShipmentImportForm, OfflineOrderForm
+from cafe.models import Basket, Warehouse, Ingredient, IngredientStock, \
+    Order, Shipment, StockAlert, Thumbnail
+from cafe.services import get_active_basket, prefetch_basket_items, \
+    get_total_cost_basket, edit_basket, serialize_basket, \
+    get_menu_categories, get_category_request, \
+    products_in_category, checkout, get_daily_sales, get_sales_analytics, \
+    get_menu_cache_stats, sync_offline_orders, ANALYTICS_GROUPS
 
 
 class HomePageView(LoginRequiredMixin, ListView):
@@ -24,11 +38,13 @@ class HomePageView(LoginRequiredMixin, ListView):
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
         context['selected_category'] = get_category_request(self.request)
-        context['categories'] = get_categories_pr_images()
-        isbasket_or_create(self.request.user)
-        with suppress(Basket.DoesNotExist):
-            context['basket'] = get_basket_items_latest(self.request.user)
-            context['total_cost'] = get_total_cost_basket(context['basket'])
+        context['categories'] = get_menu_categories()
+        context['basket'] = prefetch_basket_items(
+            get_active_basket(self.request))
+        context['total_cost'] = get_total_cost_basket(context['basket'])
+        # the terminal keeps a copy to work with while the server stalls
+        context['basket_data'] = serialize_basket(context['basket'])
+        context['order_sync_batch_size'] = settings.CAFE_ORDER_SYNC_BATCH_SIZE
         return context
 
 
@@ -37,25 +53,11 @@ class BasketEditView(LoginRequiredMixin, FormView):
     form_class = BasketEditForm
 
     def form_valid(self, form):
-        try:
-            basket = get_basket_items_latest(self.request.user)
-        except Basket.DoesNotExist:
-            basket = Basket.objects.create(user=self.request.user)
-
-        product_id = form.cleaned_data['product_id']
-        product_count = form.cleaned_data['product_count']
-        basket_item = basket.items.filter(product_id=product_id).first()
-        if basket_item:
-            basket_item.count += product_count
-            if basket_item.count <= 0:
-                basket_item.delete()
-            else:
-                basket_item.save()
-        else:
-            BasketItem.objects.create(
-                basket=basket,
-                product_id=product_id
-            )
+        edit_basket(
+            get_active_basket(self.request),
+            form.cleaned_data['product_id'],
+            form.cleaned_data['product_count']
+        )
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -68,47 +70,10 @@ class OrderView(LoginRequiredMixin, FormView):
 
     def form_valid(self, form):
         with suppress(Basket.DoesNotExist):
-            basket = Basket.objects.filter(
-                id=form.cleaned_data['basket_id']
-            ).prefetch_related('items').first()
-            basket_items = basket.items.all()
-            if basket_items:
-                Basket.objects.create(user=self.request.user)
-            order_sum = 0
-            order_cost = 0
-            for item in basket_items:
-                order_sum += round(item.count * item.product.price, 2)
-                flow_charts = Product.objects.filter(
-                    id=item.product.id
-                ).prefetch_related('flow_chart').first()
-                for flow_chart in flow_charts.flow_chart.all():
-                    shipment_of_cost = Shipment.objects.filter(
-                        ingredient=flow_chart.ingredient,
-                        warehouses__isnull=False).first()
-                    if shipment_of_cost:
-                        value_ingredient = flow_chart.value * item.count
-                        warehouse = shipment_of_cost.warehouses.first()
-                        if warehouse.value > value_ingredient:
-                            warehouse.value -= value_ingredient
-                            warehouse.save()
-                        else:
-                            warehouse.delete()
-                    else:
-                        # if the ingredient is not in stock we take its cost
-                        # from the last purchase
-                        shipment_of_cost = Shipment.objects.filter(
-                            ingredient=flow_chart.ingredient
-                        ).order_by('-date').first()
-                    if shipment_of_cost:
-                        cost_ingredient = shipment_of_cost.price
-                    else:
-                        cost_ingredient = 0
-                    order_cost += round(
-                        cost_ingredient * item.count * flow_chart.value, 2)
-            Order.objects.create(
-                basket=basket,
-                price=order_sum,
-                cost=order_cost
+            checkout(
+                Basket.objects.get(
+                    id=form.cleaned_data['basket_id'], user=self.request.user),
+                in_background=settings.CAFE_CHECKOUT_IN_BACKGROUND
             )
         return super().form_valid(form)
 
@@ -116,6 +81,120 @@ class OrderView(LoginRequiredMixin, FormView):
         return self.request.META.get('HTTP_REFERER') or reverse_lazy('home')
 
 
+def form_errors_response(form):
+    return JsonResponse({'errors': form.errors}, status=400)
+
+
+class BasketApiView(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(serialize_basket(
+            prefetch_basket_items(get_active_basket(request))))
+
+
+class BasketItemApiView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        form = BasketEditForm(request.POST)
+        if not form.is_valid():
+            return form_errors_response(form)
+        basket = get_active_basket(request)
+        edit_basket(
+            basket,
+            form.cleaned_data['product_id'],
+            form.cleaned_data['product_count']
+        )
+        return JsonResponse(serialize_basket(prefetch_basket_items(basket)))
+
+
+class CheckoutApiView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        form = OrderForm(request.POST)
+        if not form.is_valid():
+            return form_errors_response(form)
+        try:
+            basket = Basket.objects.get(
+                id=form.cleaned_data['basket_id'], user=request.user)
+        except Basket.DoesNotExist:
+            return JsonResponse(
+                {'errors': {'basket_id': ['Invalid basket ID']}}, status=400)
+        client_key = form.cleaned_data['client_key']
+        try:
+            order = checkout(
+                basket,
+                client_key=client_key,
+                in_background=settings.CAFE_CHECKOUT_IN_BACKGROUND
+            )
+        except IntegrityError:
+            # the same key was checked out with another basket meanwhile
+            order = Order.objects.get(client_key=client_key)
+        if order is None:
+            return JsonResponse(
+                {'errors': {'basket_id': ['Basket is already checked out']}},
+                status=400
+            )
+        return JsonResponse({
+            'order': {'id': order.id, 'price': order.price},
+            'basket': serialize_basket(
+                prefetch_basket_items(get_active_basket(request)))
+        })
+
+
+class OrderSyncApiView(LoginRequiredMixin, View):
+    """Receives the orders queued by a terminal while it was offline.
+
+    The body is {"orders": [{"key", "basket_id", "created_at", "items":
+    [{"product_id", "count"}]}]}, every order gets a result by its key.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            orders = json.loads(request.body)['orders']
+        except (ValueError, TypeError, KeyError):
+            return HttpResponseBadRequest('Invalid JSON')
+        if not isinstance(orders, list) or \
+                len(orders) > settings.CAFE_ORDER_SYNC_BATCH_SIZE:
+            return HttpResponseBadRequest(
+                f'Send up to {settings.CAFE_ORDER_SYNC_BATCH_SIZE} orders')
+        order_forms = [
+            OfflineOrderForm(order if isinstance(order, dict) else {})
+            for order in orders
+        ]
+        synced = sync_offline_orders(request.user, [
+            form.cleaned_data for form in order_forms if form.is_valid()])
+        results = []
+        for form in order_forms:
+            if form.is_valid():
+                key = form.cleaned_data['key']
+                results.append({'key': str(key), **synced[key]})
+            else:
+                results.append({
+                    'key': form.data.get('key'),
+                    'status': 'invalid',
+                    'errors': form.errors
+                })
+        return JsonResponse({
+            'orders': results,
+            'basket': serialize_basket(
+                prefetch_basket_items(get_active_basket(request)))
+        })
+
+
+class MenuCacheStatsView(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(get_menu_cache_stats())
+
+
+@method_decorator(
+    cache_control(public=True, max_age=365 * 24 * 3600, immutable=True),
+    name='dispatch'
+)
+class ThumbnailView(View):
+    # thumbnail names are content hashes, so they can be cached forever
+    def get(self, request, name):
+        thumbnail = get_object_or_404(Thumbnail, name=name)
+        return HttpResponse(
+            thumbnail.content, content_type=thumbnail.content_type)
+
+
 class ReportEditView(LoginRequiredMixin, TemplateView):
     template_name = 'report.html'
 
@@ -129,40 +208,133 @@ class ReportEditView(LoginRequiredMixin, TemplateView):
             context['to_date'] = str(timezone.now().date())
         form = ReportEditForm(context)
         context['form'] = form
-        _timezone = pytz.timezone(settings.TIME_ZONE)
-        orders = Order.objects.filter(
-            created_at__gte=_timezone.localize(
-                datetime.strptime(
-                    context['from_date'] + ' 00:00:00', '%Y-%m-%d %H:%M:%S'
-                )
-            ),
-            created_at__lte=_timezone.localize(
-                datetime.strptime(
-                    context['to_date'] + ' 23:59:59.999999', '%Y-%m-%d %H:%M:%S.%f'  # noqa
-                )
-            )
-        )
+        from_date = datetime.strptime(context['from_date'], '%Y-%m-%d').date()
+        to_date = datetime.strptime(context['to_date'], '%Y-%m-%d').date()
+        days = get_daily_sales(from_date, to_date)
         context['orders'] = {}
-        for order in orders:
-            date_ = str(order.created_at.date())
-            if not context['orders'].get(date_):
-                context['orders'][date_] = {}
-            orders_date = context['orders'][date_]
-            orders_date['revenue'] = orders_date.get('revenue', 0) + order.price
-            orders_date['cost'] = orders_date.get('cost', 0) + order.cost
-            orders_date['count_orders'] = orders_date.get('count_orders', 0) + 1
+        for day in days:
+            context['orders'][str(day['date'])] = {
+                'revenue': day['revenue'],
+                'cost': day['cost'],
+                'count_orders': day['order_count']
+            }
         if context['orders']:
             context['orders']['total'] = {
-                'revenue': sum(order.price for order in orders),
-                'cost': sum(order.cost for order in orders),
-                'count_orders': len(orders)
+                'revenue': sum(day['revenue'] for day in days),
+                'cost': sum(day['cost'] for day in days),
+                'count_orders': sum(day['order_count'] for day in days)
             }
         return context
 
 
+class AnalyticsView(LoginRequiredMixin, TemplateView):
+    template_name = 'analytics.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        today = str(timezone.localdate())
+        form = AnalyticsForm({
+            'from_date': self.request.GET.get('from_date', today),
+            'to_date': self.request.GET.get('to_date', today),
+            'group_by': self.request.GET.get('group_by', 'product'),
+        })
+        context['form'] = form
+        context['groups'] = ANALYTICS_GROUPS
+        context['rows'] = []
+        if form.is_valid():
+            rows = list(get_sales_analytics(**form.cleaned_data))
+            total_revenue = sum(row['revenue'] for row in rows)
+            for row in rows:
+                row['share'] = row['revenue'] * 100 / total_revenue \
+                    if total_revenue else 0
+            context['rows'] = rows
+        return context
+
+
+class ReportExportView(LoginRequiredMixin, View):
+    formats = {
+        'csv': (stream_csv, 'text/csv; charset=utf-8'),
+        'xlsx': (stream_xlsx, XLSX_CONTENT_TYPE),
+    }
+    granularities = {
+        'day': get_day_rows,
+        'order': get_order_rows,
+    }
+
+    def get(self, request, *args, **kwargs):
+        form = ReportEditForm(request.GET)
+        export_format = request.GET.get('format', 'csv')
+        granularity = request.GET.get('granularity', 'day')
+        if not form.is_valid() or export_format not in self.formats or \
+                granularity not in self.granularities:
+            return HttpResponseBadRequest('Invalid report parameters')
+
+        from_date = form.cleaned_data['from_date']
+        to_date = form.cleaned_data['to_date']
+        stream, content_type = self.formats[export_format]
+        rows = self.granularities[granularity](from_date, to_date)
+        response = StreamingHttpResponse(
+            stream(rows), content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="report_{granularity}_{from_date}_'
+            f'{to_date}.{export_format}"'
+        )
+        return response
+
+
 class WarehouseListView(LoginRequiredMixin, ListView):
     model = Warehouse
     template_name = 'warehouse.html'
+    paginate_by = 50
 
     def get_queryset(self):
-        return Warehouse.objects.prefetch_related('shipment')
+        # the page reads the balances, the lots are listed for the chosen
+        # ingredient only
+        ingredient_id = self.request.GET.get('ingredient', '')
+        self.ingredient = Ingredient.objects.filter(
+            id=ingredient_id).first() if ingredient_id.isdigit() else None
+        if self.ingredient is None:
+            return Warehouse.objects.none()
+        return Warehouse.objects.filter(
+            value__gt=0, shipment__ingredient=self.ingredient
+        ).select_related('shipment__ingredient').order_by(
+            'shipment__date', 'id')
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context['ingredient'] = self.ingredient
+        context['stocks'] = IngredientStock.objects.select_related(
+            'ingredient').order_by('ingredient__title')
+        return context
+
+
+class ShipmentImportView(LoginRequiredMixin, PermissionRequiredMixin,
+                         FormView):
+    permission_required = 'cafe.add_shipment'
+    form_class = ShipmentImportForm
+    template_name = 'shipment_import.html'
+    success_url = reverse_lazy('warehouse')
+
+    def form_valid(self, form):
+        Shipment.objects.receive(form.cleaned_data['shipments'])
+        return super().form_valid(form)
+
+
+class StockAlertListView(LoginRequiredMixin, TemplateView):
+    template_name = 'stock_alerts.html'
+    recent_count = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        alerts = StockAlert.objects.select_related('ingredient')
+        context['open_alerts'] = {
+            alert.ingredient_id: alert
+            for alert in alerts.filter(resolved_at__isnull=True)
+        }
+        context['stocks'] = IngredientStock.objects.filter(
+            on_hand__lt=F('ingredient__notify_min_balance')
+        ).select_related('ingredient').order_by('ingredient__title')
+        context['recent_alerts'] = alerts.filter(
+            resolved_at__isnull=False
+        ).order_by('-resolved_at')[:self.recent_count]
+        return context
@@ -0,0 +1,17 @@
+from django.db import connections
+
+
+def check_connections(**kwargs):
+    """Closes persistent connections the database no longer answers on.
+
+    Connections outlive the requests when CONN_MAX_AGE is set and may be
+    dropped by the server or a proxy in between. Django only notices it
+    when a query fails, so the connections with CONN_HEALTH_CHECKS are
+    pinged before they are reused and reopened on the first query.
+    """
+    for conn in connections.all():
+        if (conn.connection is not None
+                and conn.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not conn.in_atomic_block
+                and not conn.is_usable()):
+            conn.close()
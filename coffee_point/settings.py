@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'error_log.middleware.MetricsMiddleware',
     'error_log.middleware.LogExceptionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -89,6 +90,12 @@ WSGI_APPLICATION = 'coffee_point.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# Seconds a connection is reused by the requests of a worker thread, 0 opens
+# a new one for every request
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+# Ping a reused connection before the request, see coffee_point/db.py
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -97,6 +104,20 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
@@ -142,11 +163,71 @@ STATIC_ROOT = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = 'media/'
 
+# Order in which warehouse lots are consumed at checkout: 'fifo' by
+# shipment date or 'fefo' by shelf life
+CAFE_STOCK_ORDERING = os.getenv('CAFE_STOCK_ORDERING', 'fifo')
+# Skip lots locked by concurrent checkouts instead of waiting for them
+CAFE_STOCK_SKIP_LOCKED = os.getenv('CAFE_STOCK_SKIP_LOCKED', 'True') == 'True'
+# How Product.cost is calculated: 'fifo' prices the ingredients by the lots
+# checkout consumes next, 'average' by the weighted cost of the balance
+CAFE_PRODUCT_COST_METHOD = os.getenv('CAFE_PRODUCT_COST_METHOD', 'fifo')
+# Orders a terminal may sync in one request, they share a transaction
+CAFE_ORDER_SYNC_BATCH_SIZE = int(os.getenv('CAFE_ORDER_SYNC_BATCH_SIZE', 50))
+# Leave the stock of checked out orders to run_cafe_worker
+CAFE_CHECKOUT_IN_BACKGROUND = os.getenv(
+    'CAFE_CHECKOUT_IN_BACKGROUND', 'True') == 'True'
+# Seconds a menu version stays cached. Changes bump the version in the
+# database, so this only bounds the memory of the outdated versions.
+CAFE_MENU_CACHE_TIMEOUT = int(os.getenv('CAFE_MENU_CACHE_TIMEOUT', 300))
+# Comma separated backends that deliver low stock alerts, see cafe/alerts.py
+CAFE_STOCK_ALERT_BACKENDS = os.getenv(
+    'CAFE_STOCK_ALERT_BACKENDS', 'cafe.alerts.LogBackend').split(',')
+# Seconds before an ingredient that is still low is alerted again
+CAFE_STOCK_ALERT_INTERVAL = int(
+    os.getenv('CAFE_STOCK_ALERT_INTERVAL', 24 * 3600))
+# Comma separated recipients of cafe.alerts.EmailBackend
+CAFE_STOCK_ALERT_EMAILS = [
+    email for email in os.getenv('CAFE_STOCK_ALERT_EMAILS', '').split(',')
+    if email
+]
+# URL that cafe.alerts.WebhookBackend posts the alerts to as JSON
+CAFE_STOCK_ALERT_WEBHOOK_URL = os.getenv('CAFE_STOCK_ALERT_WEBHOOK_URL')
+
+EMAIL_BACKEND = os.getenv(
+    'EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+
+# Request errors are queued and written in batches by a background thread,
+# errors that do not fit into the queue are dropped and counted
+ERROR_LOG_QUEUE_SIZE = int(os.getenv('ERROR_LOG_QUEUE_SIZE', 1000))
+ERROR_LOG_BATCH_SIZE = int(os.getenv('ERROR_LOG_BATCH_SIZE', 100))
+ERROR_LOG_FLUSH_INTERVAL = float(os.getenv('ERROR_LOG_FLUSH_INTERVAL', 1))
+# Every error group keeps at most one request as a sample per interval,
+# the other occurrences are only counted
+ERROR_LOG_SAMPLE_INTERVAL = int(os.getenv('ERROR_LOG_SAMPLE_INTERVAL', 60))
+
+# Requests slower than this are logged with their slowest queries
+METRICS_SLOW_REQUEST_SECONDS = float(
+    os.getenv('METRICS_SLOW_REQUEST_SECONDS', 1))
+METRICS_SLOW_REQUEST_QUERIES = int(
+    os.getenv('METRICS_SLOW_REQUEST_QUERIES', 5))
+# Functions returning {name: value} exported as gauges with the key prefix
+METRICS_COLLECTORS = {
+    'cafe_menu_cache': 'cafe.services.get_menu_cache_stats',
+    'cafe_order_tasks': 'cafe.services.get_order_task_stats',
+}
+# Bearer token for the metrics endpoint, staff users can always read it
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
 LOGIN_REDIRECT_URL = reverse_lazy('home')
 LOGOUT_REDIRECT_URL = reverse_lazy('login')
 
 try:
     import django_heroku
     django_heroku.settings(locals())
+    # django_heroku rebuilds the database from DATABASE_URL with its own age
+    DATABASES['default'].update(
+        CONN_MAX_AGE=DB_CONN_MAX_AGE,
+        CONN_HEALTH_CHECKS=DB_CONN_HEALTH_CHECKS
+    )
 except ImportError:
     pass
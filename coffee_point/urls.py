@@ -21,5 +21,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
     path('', include('cafe.urls')),
+    path('', include('error_log.urls')),
     path('schema/', Schema.as_view()),
 ]
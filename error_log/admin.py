@@ -1,18 +1,54 @@
 from django.contrib import admin
-from error_log.models import RequestError
+from django.urls import reverse
+from django.utils.html import format_html
+
+from error_log.models import ErrorGroup, RequestError
+
+
+class ErrorGroupAdmin(admin.ModelAdmin):
+    list_display = (
+        'exception_name',
+        'exception_value',
+        'path',
+        'count',
+        'first_seen',
+        'last_seen',
+        'samples_link'
+    )
+    search_fields = ('=fingerprint', 'exception_name', 'path')
+    readonly_fields = (
+        'fingerprint',
+        'exception_name',
+        'exception_value',
+        'path',
+        'count',
+        'first_seen',
+        'last_seen',
+        'last_sample_at',
+        'samples_link'
+    )
+
+    def samples_link(self, obj):
+        url = reverse('admin:error_log_requesterror_changelist')
+        return format_html(
+            '<a href="{}?group__id__exact={}">Примеры</a>', url, obj.id)
+    samples_link.short_description = 'Примеры'
 
 
 class RequestErrorAdmin(admin.ModelAdmin):
+    # samples are looked up through their group, filtering and searching
+    # the whole table would scan it
     list_display = (
         'exception_name',
         'exception_value',
         'request_method',
         'path',
+        'occurrences',
         'created_at'
     )
-    list_filter = ('exception_name', 'request_method', 'created_at')
-    search_fields = ('exception_name', 'exception_value', 'path')
+    show_full_result_count = False
     readonly_fields = (
+        'group',
         'exception_name',
         'exception_value',
         'exception_tb',
@@ -20,8 +56,11 @@ class RequestErrorAdmin(admin.ModelAdmin):
         'data',
         'request_method',
         'path',
+        'tb_hash',
+        'occurrences',
         'created_at'
     )
 
 
+admin.site.register(ErrorGroup, ErrorGroupAdmin)
 admin.site.register(RequestError, RequestErrorAdmin)
@@ -0,0 +1,116 @@
+import atexit
+import hashlib
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from error_log.models import ErrorGroup, get_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+def merge_errors(errors):
+    """Collapses repeated errors of a batch into one per fingerprint."""
+    merged = {}
+    for error in errors:
+        if error.fingerprint in merged:
+            merged[error.fingerprint].occurrences += error.occurrences
+        else:
+            merged[error.fingerprint] = error
+    return list(merged.values())
+
+
+class ErrorBuffer:
+    """Collects request errors and writes them from a background thread.
+
+    The queue is bounded: when the database can not keep up the new errors
+    are dropped and counted instead of slowing the requests down.
+    """
+
+    def __init__(self, max_size, batch_size, flush_interval):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, error):
+        error.tb_hash = hashlib.sha1(error.exception_tb.encode()).hexdigest()
+        error.fingerprint = get_fingerprint(
+            error.exception_name, error.exception_tb)
+        try:
+            self.queue.put_nowait(error)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return
+        self.start()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='error-log', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            # wait a little so that an error storm is written in batches
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            self.write(batch)
+            close_old_connections()
+
+    def flush(self):
+        """Writes the queued errors in the calling thread."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(batch), self.batch_size):
+            self.write(batch[start:start + self.batch_size])
+
+    def write(self, batch):
+        try:
+            with transaction.atomic():
+                ErrorGroup.objects.record(merge_errors(batch))
+        except Exception:
+            logger.exception('Could not write %d request errors', len(batch))
+            with self.lock:
+                self.dropped += len(batch)
+            return
+        with self.lock:
+            self.written += len(batch)
+            dropped = self.dropped - self.reported_dropped
+            self.reported_dropped = self.dropped
+        if dropped:
+            logger.warning('%d request errors were dropped', dropped)
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped
+        }
+
+
+error_buffer = ErrorBuffer(
+    max_size=settings.ERROR_LOG_QUEUE_SIZE,
+    batch_size=settings.ERROR_LOG_BATCH_SIZE,
+    flush_interval=settings.ERROR_LOG_FLUSH_INTERVAL
+)
+atexit.register(error_buffer.flush)
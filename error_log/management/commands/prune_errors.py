@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from error_log.models import ErrorGroup, RequestError
+
+
+class Command(BaseCommand):
+    help = 'Deletes stale error groups and old samples of the others'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=90,
+            help='Delete groups not seen for this many days'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=20,
+            help='Latest samples to keep in every group'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        if options['keep'] < 1:
+            raise CommandError('--keep must be at least 1')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # samples are deleted with plain DELETE statements instead of
+        # being collected through the group cascade
+        stale, _ = RequestError.objects.filter(
+            group__last_seen__lt=cutoff).delete()
+        groups, _ = ErrorGroup.objects.filter(last_seen__lt=cutoff).delete()
+        ungrouped, _ = RequestError.objects.filter(
+            group__isnull=True, created_at__lt=cutoff).delete()
+
+        oldest_kept = RequestError.objects.filter(
+            group=OuterRef('group')
+        ).order_by('-id').values('id')[options['keep'] - 1:options['keep']]
+        samples, _ = RequestError.objects.filter(
+            id__lt=Subquery(oldest_kept)).delete()
+        self.stdout.write(
+            f'Deleted {groups} error groups and '
+            f'{stale + ungrouped + samples} samples'
+        )
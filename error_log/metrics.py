@@ -0,0 +1,142 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from error_log.buffer import error_buffer
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """Yields (le, cumulative count) pairs, the last one is +Inf."""
+        total = 0
+        for le, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield le, total
+
+
+class QueryTimer:
+    """Execute wrapper that counts queries and keeps the slowest ones."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.count = 0
+        self.duration = 0
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if self.keep:
+                query = (duration, self.count, sql)
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, query)
+                else:
+                    heapq.heappushpop(self.slowest, query)
+
+
+class RequestMetrics:
+    """Request histograms of the current worker process.
+
+    Histograms are cumulative since the process start, Prometheus takes
+    the rates over its scrape window.
+    """
+
+    METRICS = (
+        ('cafe_request_duration_seconds', 'Request wall time',
+         DURATION_BUCKETS),
+        ('cafe_request_db_duration_seconds', 'Time spent in SQL queries',
+         DURATION_BUCKETS),
+        ('cafe_request_queries', 'SQL queries per request', QUERY_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            name: defaultdict(lambda buckets=buckets: Histogram(buckets))
+            for name, _, buckets in self.METRICS
+        }
+
+    def observe(self, view, duration, timer):
+        with self.lock:
+            self.histograms['cafe_request_duration_seconds'][view].observe(
+                duration)
+            self.histograms['cafe_request_db_duration_seconds'][
+                view].observe(timer.duration)
+            self.histograms['cafe_request_queries'][view].observe(
+                timer.count)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, description, _ in self.METRICS:
+                lines += [f'# HELP {name} {description}',
+                          f'# TYPE {name} histogram']
+                for view, histogram in sorted(self.histograms[name].items()):
+                    label = f'view="{view}"'
+                    for le, count in histogram.samples():
+                        lines.append(
+                            f'{name}_bucket{{{label},le="{le}"}} {count}')
+                    lines += [
+                        f'{name}_sum{{{label}}} {histogram.sum}',
+                        f'{name}_count{{{label}}} {count}'
+                    ]
+        for name, value in sorted(get_gauges().items()):
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def get_gauges():
+    gauges = {
+        f'error_log_errors_{name}': value
+        for name, value in error_buffer.stats().items()
+    }
+    for prefix, path in settings.METRICS_COLLECTORS.items():
+        try:
+            stats = import_string(path)()
+        except Exception:
+            logger.exception('Metrics collector %s failed', path)
+            continue
+        gauges.update(
+            (f'{prefix}_{name}', value) for name, value in stats.items())
+    return gauges
+
+
+def log_slow_request(request, view, duration, timer):
+    queries = '\n'.join(
+        f'  {query_time * 1000:.1f} ms: {sql}'
+        for query_time, _, sql in sorted(timer.slowest, reverse=True)
+    )
+    logger.warning(
+        'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms\n%s',
+        request.method, request.path, view, duration * 1000, timer.count,
+        timer.duration * 1000, queries
+    )
+
+
+request_metrics = RequestMetrics()
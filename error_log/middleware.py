@@ -1,8 +1,33 @@
+import time
 import traceback
 
+from django.conf import settings
+from django.db import connection
+
+from error_log.buffer import error_buffer
+from error_log.metrics import QueryTimer, log_slow_request, request_metrics
 from error_log.models import RequestError
 
 
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer(keep=settings.METRICS_SLOW_REQUEST_QUERIES)
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        request_metrics.observe(view, duration, timer)
+        if duration >= settings.METRICS_SLOW_REQUEST_SECONDS:
+            log_slow_request(request, view, duration, timer)
+        return response
+
+
 class LogExceptionMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -11,12 +36,14 @@ class LogExceptionMiddleware:
         return self.get_response(request)
 
     def process_exception(self, request, exception):
-        RequestError.objects.create(
-            exception_name=str(type(exception)),
-            exception_value=str(exception),
+        # the error is written in the background, so a failing database
+        # does not get an extra write from every failing request
+        error_buffer.add(RequestError(
+            exception_name=str(type(exception))[:50],
+            exception_value=str(exception)[:250],
             exception_tb='\n'.join(traceback.format_tb(exception.__traceback__)),  # noqa
             request_method=request.method,
-            path=request.path,
+            path=request.path[:500],
             query=dict(request.GET),
             data=dict(request.POST)
-        )
+        ))
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('error_log', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requesterror',
+            name='occurrences',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='requesterror',
+            name='tb_hash',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+    ]
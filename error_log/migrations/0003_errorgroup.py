@@ -0,0 +1,98 @@
+# Generated by Django 3.0.6 on 2026-10-18 07:44
+
+import hashlib
+import re
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+
+# a copy of error_log.models.get_fingerprint as of this migration, later
+# changes to it must not change how the existing rows were grouped
+FRAME_RE = re.compile(
+    r'^\s*File "(?P<file>[^"]+)", line \d+, in (?P<func>.+)$')
+
+
+def get_fingerprint(exception_name, exception_tb):
+    frames = [
+        f'{match["file"]}:{match["func"]}'
+        for match in map(FRAME_RE.match, exception_tb.splitlines())
+        if match
+    ]
+    return hashlib.sha1(
+        '\n'.join([exception_name, *frames]).encode()).hexdigest()
+
+
+def group_request_errors(apps, schema_editor):
+    # the existing rows become the samples of their groups
+    ErrorGroup = apps.get_model('error_log', 'ErrorGroup')
+    RequestError = apps.get_model('error_log', 'RequestError')
+    errors = RequestError.objects.only(
+        'exception_name', 'exception_value', 'exception_tb', 'path',
+        'created_at', 'occurrences'
+    ).order_by('id')
+    last_id = 0
+    while batch := list(errors.filter(id__gt=last_id)[:1000]):
+        last_id = batch[-1].id
+        by_fingerprint = defaultdict(list)
+        for error in batch:
+            by_fingerprint[get_fingerprint(
+                error.exception_name, error.exception_tb)].append(error)
+        ErrorGroup.objects.bulk_create(
+            (ErrorGroup(
+                fingerprint=fingerprint,
+                exception_name=samples[0].exception_name,
+                exception_value=samples[0].exception_value,
+                path=samples[0].path,
+                first_seen=samples[0].created_at,
+                last_seen=samples[0].created_at
+            ) for fingerprint, samples in by_fingerprint.items()),
+            ignore_conflicts=True
+        )
+        groups = ErrorGroup.objects.in_bulk(
+            list(by_fingerprint), field_name='fingerprint')
+        for fingerprint, samples in by_fingerprint.items():
+            group = groups[fingerprint]
+            RequestError.objects.filter(
+                id__in=[sample.id for sample in samples]
+            ).update(group=group)
+            group.count = F('count') + sum(
+                sample.occurrences for sample in samples)
+            group.last_seen = group.last_sample_at = max(
+                sample.created_at for sample in samples)
+        ErrorGroup.objects.bulk_update(
+            groups.values(), ['count', 'last_seen', 'last_sample_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('error_log', '0002_request_error_occurrences'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ErrorGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('exception_name', models.CharField(max_length=50)),
+                ('exception_value', models.CharField(max_length=250)),
+                ('path', models.CharField(max_length=500)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField(db_index=True)),
+                ('last_sample_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ('-last_seen',),
+            },
+        ),
+        migrations.AddField(
+            model_name='requesterror',
+            name='group',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='samples', to='error_log.ErrorGroup'),
+        ),
+        migrations.RunPython(group_request_errors, migrations.RunPython.noop),
+    ]
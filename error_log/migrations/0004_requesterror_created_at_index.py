@@ -0,0 +1,17 @@
+# Generated by Django 3.0.6 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('error_log', '0003_errorgroup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requesterror',
+            index=models.Index(fields=['-created_at'], name='error_log_r_created_99c1c3_idx'),
+        ),
+    ]
@@ -1,8 +1,101 @@
+import hashlib
+import re
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
+
+FRAME_RE = re.compile(
+    r'^\s*File "(?P<file>[^"]+)", line \d+, in (?P<func>.+)$')
+
+
+def get_fingerprint(exception_name, exception_tb):
+    """Hashes the exception class and the traceback frames.
+
+    Line numbers and source lines are left out, so the fingerprint
+    survives unrelated edits of the files in the traceback.
+    """
+    frames = [
+        f'{match["file"]}:{match["func"]}'
+        for match in map(FRAME_RE.match, exception_tb.splitlines())
+        if match
+    ]
+    return hashlib.sha1(
+        '\n'.join([exception_name, *frames]).encode()).hexdigest()
+
+
+class ErrorGroupManager(models.Manager):
+    def record(self, errors):
+        """Counts ``errors`` in their groups and saves some as samples.
+
+        ``errors`` are unsaved request errors with distinct fingerprints,
+        a sample is saved at most once per ERROR_LOG_SAMPLE_INTERVAL
+        for every group.
+        """
+        if not errors:
+            return
+        now = timezone.now()
+        self.bulk_create(
+            (ErrorGroup(
+                fingerprint=error.fingerprint,
+                exception_name=error.exception_name,
+                exception_value=error.exception_value,
+                path=error.path,
+                first_seen=now,
+                last_seen=now
+            ) for error in errors),
+            ignore_conflicts=True
+        )
+        groups = self.filter(
+            fingerprint__in=[error.fingerprint for error in errors]
+        ).only('id', 'fingerprint', 'last_sample_at').in_bulk(
+            field_name='fingerprint')
+        sample_before = now - timedelta(
+            seconds=settings.ERROR_LOG_SAMPLE_INTERVAL)
+        samples = []
+        for error in errors:
+            group = groups[error.fingerprint]
+            if group.last_sample_at is None or \
+                    group.last_sample_at < sample_before:
+                group.last_sample_at = now
+                error.group = group
+                samples.append(error)
+            group.count = F('count') + error.occurrences
+            group.last_seen = now
+        self.bulk_update(
+            groups.values(), ['count', 'last_seen', 'last_sample_at'])
+        RequestError.objects.bulk_create(samples)
+
+
+class ErrorGroup(models.Model):
+    fingerprint = models.CharField(max_length=40, unique=True)
+    exception_name = models.CharField(max_length=50)
+    exception_value = models.CharField(max_length=250)
+    path = models.CharField(max_length=500)
+    count = models.PositiveIntegerField(default=0)
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField(db_index=True)
+    last_sample_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ErrorGroupManager()
+
+    class Meta:
+        ordering = ('-last_seen', )
+
+    def __str__(self):
+        return f'{self.exception_name}: {self.exception_value}'
 
 
 class RequestError(models.Model):
+    group = models.ForeignKey(
+        ErrorGroup,
+        on_delete=models.CASCADE,
+        related_name='samples',
+        null=True
+    )
     exception_name = models.CharField(max_length=50)
     exception_value = models.CharField(max_length=250)
     exception_tb = models.TextField()
@@ -11,9 +104,14 @@ class RequestError(models.Model):
     query = JSONField()
     data = JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
+    tb_hash = models.CharField(max_length=40, blank=True)
+    occurrences = models.PositiveIntegerField(default=1)
 
     class Meta:
         ordering = ('-created_at', )
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
 
     def __str__(self):
         return f'{self.exception_name}: {self.exception_value}'
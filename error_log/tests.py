@@ -1,3 +1,164 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, \
+    override_settings
+from django.urls import reverse
+
+from error_log.buffer import ErrorBuffer, merge_errors
+from error_log.metrics import Histogram
+from error_log.middleware import LogExceptionMiddleware
+from error_log.models import ErrorGroup, RequestError, get_fingerprint
+
+TRACEBACK = '''  File "/app/cafe/views.py", line {line}, in {func}
+    checkout(basket)
+  File "/app/cafe/services.py", line 240, in checkout
+    return checkout_basket(basket)
+'''
+
+
+def make_error(path='/', tb=TRACEBACK.format(line=68, func='form_valid')):
+    return RequestError(
+        exception_name="<class 'ValueError'>",
+        exception_value='boom',
+        exception_tb=tb,
+        request_method='GET',
+        path=path,
+        query={},
+        data={}
+    )
+
+
+class FingerprintTest(SimpleTestCase):
+    def test_fingerprint_ignores_line_numbers(self):
+        name = "<class 'ValueError'>"
+        fingerprint = get_fingerprint(
+            name, TRACEBACK.format(line=68, func='form_valid'))
+        self.assertEqual(fingerprint, get_fingerprint(
+            name, TRACEBACK.format(line=70, func='form_valid')))
+        self.assertNotEqual(fingerprint, get_fingerprint(
+            name, TRACEBACK.format(line=68, func='post')))
+        self.assertNotEqual(fingerprint, get_fingerprint(
+            "<class 'KeyError'>",
+            TRACEBACK.format(line=68, func='form_valid')
+        ))
+
+
+@mock.patch.object(ErrorBuffer, 'start')
+class ErrorBufferTest(SimpleTestCase):
+    def test_full_queue_drops_and_counts(self, start):
+        buffer = ErrorBuffer(max_size=2, batch_size=10, flush_interval=0)
+        for _ in range(5):
+            buffer.add(make_error())
+        self.assertEqual(buffer.stats(), {
+            'queued': 2, 'written': 0, 'dropped': 3})
+
+    def test_merges_errors_with_the_same_fingerprint(self, start):
+        errors = [make_error(), make_error(), make_error(path='/order'),
+                  make_error(tb=TRACEBACK.format(line=1, func='post'))]
+        buffer = ErrorBuffer(max_size=10, batch_size=10, flush_interval=0)
+        for error in errors:
+            buffer.add(error)
+        merged = merge_errors(errors)
+        self.assertEqual(
+            [(error.path, error.occurrences) for error in merged],
+            [('/', 3), ('/', 1)]
+        )
+
+    def test_middleware_does_not_write_in_the_request(self, start):
+        request = RequestFactory().post('/order', {'basket_id': 1})
+        middleware = LogExceptionMiddleware(lambda request: None)
+        with mock.patch('error_log.middleware.error_buffer') as buffer:
+            middleware.process_exception(request, ValueError('boom'))
+        error = buffer.add.call_args[0][0]
+        self.assertIsNone(error.pk)
+        self.assertEqual(error.data, {'basket_id': ['1']})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'JSONField needs PostgreSQL')
+class ErrorGroupTest(TestCase):
+    def add_errors(self, *tracebacks):
+        buffer = ErrorBuffer(max_size=10, batch_size=2, flush_interval=0)
+        with mock.patch.object(ErrorBuffer, 'start'):
+            for tb in tracebacks:
+                buffer.add(make_error(tb=tb))
+        buffer.flush()
+
+    def test_groups_count_errors_and_keep_samples(self):
+        view = TRACEBACK.format(line=68, func='form_valid')
+        other = TRACEBACK.format(line=68, func='post')
+        self.add_errors(view, view, view, other)
+        self.add_errors(view)
+        self.assertEqual(
+            list(ErrorGroup.objects.order_by('count').values_list(
+                'count', flat=True)),
+            [1, 4]
+        )
+        # one sample per group and sample interval
+        self.assertEqual(
+            list(RequestError.objects.order_by('occurrences').values_list(
+                'occurrences', flat=True)),
+            [1, 2]
+        )
+
+    def test_prune_keeps_latest_samples(self):
+        self.add_errors(TRACEBACK.format(line=68, func='form_valid'))
+        group = ErrorGroup.objects.get()
+        for _ in range(3):
+            RequestError.objects.create(
+                group=group, **{
+                    field: getattr(group.samples.first(), field)
+                    for field in ('exception_name', 'exception_value',
+                                  'exception_tb', 'request_method', 'path',
+                                  'query', 'data')
+                })
+        call_command('prune_errors', keep=2, stdout=StringIO())
+        self.assertEqual(group.samples.count(), 2)
+
+    def test_prune_keeps_at_least_one_sample(self):
+        for keep in (0, -1):
+            with self.assertRaises(CommandError):
+                call_command('prune_errors', keep=keep, stdout=StringIO())
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_login(self.user)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(
+            list(histogram.samples()), [(1, 2), (5, 3), ('+Inf', 4)])
+        self.assertEqual(histogram.sum, 14.5)
+
+    def test_views_are_measured(self):
+        self.client.get(reverse('home'))
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'cafe_request_duration_seconds_bucket{view="home",le="+Inf"}',
+            metrics)
+        self.assertRegex(
+            metrics, r'cafe_request_queries_sum\{view="home"\} [1-9]')
+        self.assertIn('cafe_menu_cache_misses', metrics)
+        self.assertIn('error_log_errors_dropped', metrics)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged_with_queries(self):
+        with self.assertLogs('error_log.metrics', 'WARNING') as logs:
+            self.client.get(reverse('home'))
+        self.assertIn('Slow request GET / (home)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_need_staff_or_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
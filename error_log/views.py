@@ -1,3 +1,23 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.generic import View
 
-# Create your views here.
+from error_log.metrics import request_metrics
+
+
+class MetricsView(View):
+    def has_access(self, request):
+        if request.user.is_staff:
+            return True
+        token = settings.METRICS_TOKEN
+        return bool(token) and constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}')
+
+    def get(self, request, *args, **kwargs):
+        if not self.has_access(request):
+            return HttpResponseForbidden()
+        return HttpResponse(
+            request_metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
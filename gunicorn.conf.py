@@ -0,0 +1,30 @@
+"""Gunicorn settings of the web process, see the Deployment section of
+README.md.
+
+Every worker thread keeps its own database connection, so a dyno holds up
+to WEB_CONCURRENCY * GUNICORN_THREADS connections to PostgreSQL.
+"""
+import multiprocessing
+import os
+
+bind = f'0.0.0.0:{os.getenv("PORT", "8000")}'
+
+# Heroku sets WEB_CONCURRENCY from the dyno size
+workers = int(os.getenv(
+    'WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Threads of a worker, more than one switches to the threaded worker
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Seconds a request may take before its worker is restarted
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+# Seconds an idle keep-alive client connection is held by gthread workers
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Workers are restarted after this many requests, 0 keeps them running,
+# the jitter spreads the restarts of the workers
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# the application is loaded after the fork, the workers must not share
+# the database connections opened while it is imported
+preload_app = False